@@ -0,0 +1,264 @@
+"""
+Asyncio Audio Prober for probing lots of urls concurrently
+"""
+
+import asyncio
+import os
+import signal
+import time
+
+from cocommon.utils.compat import subprocess
+
+from aucommon.auprobe import (
+    AudioProber, InvalidURL, MAX_LINE_LENGTH, PCM_CHUNK_SIZE,
+    _ProtocolProbing, result_of_prober)
+
+# options of AudioProber the asyncio prober does not implement
+UNSUPPORTED_OPTIONS = ('race_protocols', 'hedge', 'http_pool', 'segments')
+
+
+async def check_output(cmd, timeout=None, stderr=None):
+    """Asyncio version of subprocess.check_output.
+
+    The child is killed on timeout or cancellation.
+
+    :param cmd: command as a list
+    :param timeout: timeout in seconds, None for no timeout
+    :param stderr: None | subprocess.STDOUT | subprocess.DEVNULL"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output
+
+
+class AsyncAudioProber(AudioProber):
+
+    """Audio Prober running ffprobe and ffmpeg as asyncio subprocesses.
+
+    Call and await probe() first, then all properties of AudioProber
+    are available without blocking.
+    Protocols are probed one after another; race_protocols, hedge,
+    http_pool and segments are not supported."""
+
+    def __init__(self, url, **kwargs):
+        for option in UNSUPPORTED_OPTIONS:
+            if kwargs.get(option):
+                raise ValueError('{} is not supported by '
+                                 'AsyncAudioProber'.format(option))
+        super(AsyncAudioProber, self).__init__(url, **kwargs)
+
+    async def probe(self):
+        """Probe tracks, select best track, get volume and loudness."""
+        if not await self._async_get_audio_tracks():
+            raise InvalidURL(self._url)
+        self._get_best_track()
+        await self._async_get_volume_and_loudness()
+
+    async def _async_get_volume_and_loudness(self):
+        """Asyncio version of AudioProber._get_volume_and_loudness."""
+        if self._load_cached_analysis():
+            return
+
+        if self._need_spool():
+            try:
+                if not self._find_spool():
+                    cmd, timeout = self._prepare_spool()
+                    with self._measure('spool', proto=self._proto,
+                                       timeout=timeout) as event:
+                        await check_output(
+                            cmd, timeout=timeout, stderr=subprocess.STDOUT)
+                        event['bytes'] = os.path.getsize(self._spool_path)
+                    self._keep_spool()
+                self._load_spool(await check_output(
+                    self._probe_cmd('file', self._spool_path)))
+            except BaseException:
+                self.close()
+                raise
+
+        if self._engine == 'numpy':
+            cmd, analyzer, timeout = self._prepare_pcm_analysis()
+        else:
+            cmd, module_data, timeout = self._prepare_analysis()
+        with self._measure('analysis', proto=self._proto,
+                           engine=self._engine, timeout=timeout) as event:
+            if self._engine == 'numpy':
+                event['output_bytes'] = await self._async_run_pcm_analysis(
+                    cmd, analyzer, timeout)
+            else:
+                event['output_bytes'] = await self._async_run_analysis(
+                    cmd, module_data, timeout)
+            event['tested_duration'] = self._tested_duration
+        self._store_cached_analysis()
+
+    async def _async_run_pcm_analysis(self, cmd, analyzer, timeout):
+        """Asyncio version of AudioProber._run_pcm_analysis."""
+        tracker = self._new_tracker()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL)
+
+        bytes_read = 0
+
+        async def analyze():
+            nonlocal bytes_read
+            while True:
+                data = await proc.stdout.read(PCM_CHUNK_SIZE)
+                if not data:
+                    break
+                bytes_read += len(data)
+                analyzer.feed(data)
+                if tracker is not None:
+                    self._update_pcm_tracker(tracker, analyzer)
+                    if tracker.converged:
+                        break
+
+        try:
+            await asyncio.wait_for(analyze(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            if proc.returncode is None and not proc.stdout.at_eof():
+                proc.kill()
+            await proc.wait()
+
+        if proc.returncode and not (tracker and tracker.converged):
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        self._volume, self._loudness = analyzer.result()
+        self._finish_tracker(tracker)
+        return bytes_read
+
+    async def _async_run_analysis(self, cmd, module_data, timeout):
+        """Asyncio version of AudioProber._run_analysis."""
+        tracker = self._new_tracker()
+        parser = self._new_parser(module_data, tracker)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            limit=MAX_LINE_LENGTH)
+        stopping = False
+        bytes_read = 0
+
+        async def parse():
+            nonlocal stopping, bytes_read
+            while not parser.done:
+                try:
+                    line = await proc.stderr.readline()
+                except ValueError:  # line too long, drop it
+                    continue
+                if not line:
+                    break
+                bytes_read += len(line)
+                parser.feed(line)
+                if not stopping and tracker is not None and \
+                        tracker.converged and proc.returncode is None:
+                    # ffmpeg prints summaries when interrupted
+                    proc.send_signal(signal.SIGINT)
+                    stopping = True
+
+        try:
+            await asyncio.wait_for(parse(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            if proc.returncode is None and not proc.stderr.at_eof():
+                proc.kill()
+            await proc.wait()
+
+        if not parser.done and proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        self._set_analysis_result(parser)
+        self._finish_tracker(tracker)
+        return bytes_read
+
+    async def _async_get_audio_tracks(self):
+        """Asyncio version of AudioProber._get_audio_tracks."""
+        if self._load_cached_tracks():
+            return self._tracks
+
+        if self._parse_local_headers():
+            return self._tracks
+
+        streams = {}
+        for proto in self.possible_protocols:
+            probing = _ProtocolProbing(self, proto)
+            for retry, timeout in probing.attempts():
+                try:
+                    with self._measure('ffprobe', proto=proto, retry=retry,
+                                       timeout=timeout) as event:
+                        (tier, json_data,
+                         start_time) = await self._async_run_tiers(
+                            proto, timeout)
+                        event['tier'] = tier
+                        event['output_bytes'] = len(json_data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    probing.failed(e)
+                else:
+                    probing.succeeded(json_data, start_time)
+            streams[proto] = probing.result()
+        return self._select_protocol(streams)
+
+    async def _async_run_tiers(self, proto, timeout):
+        """Asyncio version of AudioProber._run_tiers."""
+        for tier, cmd in self._tier_cmds(proto):
+            start_time = time.time()
+            try:
+                json_data = await check_output(cmd, timeout=timeout)
+            except (subprocess.CalledProcessError,
+                    subprocess.TimeoutExpired) as e:
+                self._tier_failed(proto, tier, e)
+                continue
+            if self._accept_tier(proto, tier, json_data):
+                return tier, json_data, start_time
+
+
+async def async_probe_and_select_from_stream(url, **kwargs):
+    """Asyncio version of auprobe.probe_and_select_from_stream."""
+    with AsyncAudioProber(url, **kwargs) as ap:
+        await ap.probe()
+        return result_of_prober(ap)
+
+
+async def probe_many(urls, concurrency=10, **kwargs):
+    """Probe urls concurrently, yield results as they finish.
+
+    At most <concurrency> urls are probed at the same time.
+    Errors are kept per url, one failed url does not affect others.
+
+    Will yield tuples:
+        (url, result, error)
+    with exactly one of result and error being None.
+
+    :param urls: an iterable of urls
+    :param concurrency: max number of urls probed at the same time
+    :param kwargs: arguments passed to AsyncAudioProber"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe_one(url):
+        async with semaphore:
+            try:
+                result = await async_probe_and_select_from_stream(
+                    url, **kwargs)
+            except Exception as e:
+                return url, None, e
+            return url, result, None
+
+    tasks = [asyncio.ensure_future(probe_one(url)) for url in urls]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in tasks:
+            task.cancel()
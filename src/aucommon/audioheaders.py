@@ -0,0 +1,465 @@
+"""
+Pure-Python Header Parsers of Common Local Audio Files
+
+ADTS AAC, MPEG audio (mp1 / mp2 / mp3), WAV, FLAC and Ogg Vorbis files
+are parsed into the same track dicts as ffprobe output parsed by
+AudioProber, without spawning ffprobe.
+Only headers are read, plus frame headers of ADTS and MPEG audio
+if scanning frames for exact duration and bitrate.
+ADTSIndex keeps offsets of all frames of an ADTS file, and of the ID3
+tags between them.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+NONEXIST = -1  # same as auprobe
+HEAD_SIZE = 4096  # bytes read to detect format
+TAIL_SIZE = 65536  # bytes read from the end to find last Ogg page
+ESTIMATE_FRAMES = 32  # frames used to estimate bitrate if not scanning
+INDEX_CACHE_SIZE = 64  # ADTSIndex of files kept by ADTSIndex.of_file
+
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                     22050, 16000, 12000, 11025, 8000, 7350)
+ADTS_PROFILES = ('Main', 'LC', 'SSR', 'LTP')
+
+MPEG_SAMPLE_RATES = {  # keyed by version bits
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),  # MPEG-2.5
+    }
+MPEG_BIT_RATES = {  # kbps keyed by (MPEG-1, layer)
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352,
+                384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256,
+                320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224,
+                256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192,
+                 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144,
+                 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144,
+                 160),
+    }
+WAV_CODECS = {  # keyed by (format tag, bits per sample)
+    (1, 8): 'pcm_u8',
+    (1, 16): 'pcm_s16le',
+    (1, 24): 'pcm_s24le',
+    (1, 32): 'pcm_s32le',
+    (3, 32): 'pcm_f32le',
+    (3, 64): 'pcm_f64le',
+    }
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def probe_file(path, scan=False):
+    """Parse audio track of a local file.
+
+    :param path: path of local file
+    :param scan: walk all frames of ADTS and MPEG audio for exact
+        duration and bitrate, instead of estimating them from the first
+        frames and file size
+    Will return a dict like AudioProber.tracks:
+        {track_index: track_info}
+    or None if format is not supported or file is damaged."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return None
+    with open(path, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for parse in (_parse_wav, _parse_flac, _parse_ogg,
+                          _parse_adts, _parse_mpeg):
+                try:
+                    track = parse(m, size, scan)
+                except (struct.error, IndexError, ValueError,
+                        ZeroDivisionError):
+                    track = None
+                if track is not None:
+                    track['index'] = 0
+                    return {0: track}
+        finally:
+            m.close()
+    return None
+
+
+def _track(codec, format_name, sample_rate, channels,
+           bit_rate=NONEXIST, duration=NONEXIST, profile=''):
+    return {
+        'codec': codec,
+        'profile': profile,
+        'bit_rate': int(bit_rate),
+        'sample_rate': int(sample_rate),
+        'channels': int(channels),
+        'duration': float(duration),
+        'format_name': format_name,
+        }
+
+
+def id3v2_size(data, offset=0):
+    """Size of ID3v2 tag at offset of data, 0 if no tag."""
+    if data[offset:offset + 3] != b'ID3' or len(data) < offset + 10:
+        return 0
+    flags = data[offset + 5]
+    size = 0
+    for b in bytearray(data[offset + 6:offset + 10]):
+        size = (size << 7) | (b & 0x7f)
+    return 10 + size + (10 if flags & 0x10 else 0)
+
+
+def _parse_wav(m, size, scan):
+    if m[:4] != b'RIFF' or m[8:12] != b'WAVE':
+        return None
+    offset = 12
+    fmt = None
+    while offset + 8 <= size:
+        chunk_id = m[offset:offset + 4]
+        chunk_size, = struct.unpack('<I', m[offset + 4:offset + 8])
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', m[offset + 8:offset + 24])
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # format tag is the first 2 bytes of sub format guid
+                fmt = struct.unpack('<H', m[offset + 32:offset + 34]) + \
+                    fmt[1:]
+        elif chunk_id == b'data' and fmt is not None:
+            tag, channels, sample_rate, byte_rate, _, bits = fmt
+            codec = WAV_CODECS.get((tag, bits))
+            if codec is None:
+                return None
+            data_size = min(chunk_size, size - offset - 8)
+            return _track(codec, 'wav', sample_rate, channels,
+                          byte_rate * 8, data_size / float(byte_rate))
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _parse_flac(m, size, scan):
+    offset = id3v2_size(m)
+    if m[offset:offset + 4] != b'fLaC':
+        return None
+    block_type = m[offset + 4] & 0x7f
+    if block_type != 0:  # STREAMINFO must come first
+        return None
+    info = m[offset + 8:offset + 8 + 34]
+    packed, = struct.unpack('>Q', info[10:18])
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xfffffffff
+    if not sample_rate:
+        return None
+    duration = NONEXIST
+    bit_rate = NONEXIST
+    if total_samples:
+        duration = total_samples / float(sample_rate)
+        bit_rate = (size - offset) * 8 / duration
+    return _track('flac', 'flac', sample_rate, channels, bit_rate, duration)
+
+
+def _parse_ogg(m, size, scan):
+    if m[:4] != b'OggS':
+        return None
+    n_segments = m[26]
+    packet = m[27 + n_segments:27 + n_segments + 30]
+    if packet[:7] != b'\x01vorbis':
+        return None
+    (_, channels, sample_rate, _,
+     nominal, _) = struct.unpack('<IBIiii', packet[7:28])
+    duration = NONEXIST
+    last = m.rfind(b'OggS', max(0, size - TAIL_SIZE))
+    if last >= 0:
+        granule, = struct.unpack('<q', m[last + 6:last + 14])
+        if granule > 0:
+            duration = granule / float(sample_rate)
+    bit_rate = nominal if nominal > 0 else NONEXIST
+    return _track('vorbis', 'ogg', sample_rate, channels,
+                  bit_rate, duration)
+
+
+def _adts_frame(m, offset):
+    """Parse ADTS header at offset.
+
+    Will return a tuple:
+        (frame_length, profile, sample_rate, channels),
+    or None if there is no valid header."""
+    h = m[offset:offset + 7]
+    if len(h) < 7 or h[0] != 0xff or h[1] & 0xf6 != 0xf0:
+        return None
+    sf_index = (h[2] >> 2) & 0xf
+    if sf_index >= len(ADTS_SAMPLE_RATES):
+        return None
+    channels = ((h[2] & 0x1) << 2) | (h[3] >> 6)
+    frame_length = ((h[3] & 0x3) << 11) | (h[4] << 3) | (h[5] >> 5)
+    if frame_length < 7:
+        return None
+    return (frame_length, ADTS_PROFILES[h[2] >> 6],
+            ADTS_SAMPLE_RATES[sf_index], 8 if channels == 7 else channels)
+
+
+def adts_header(data, offset=0):
+    """Parse ADTS header at offset of data, bytes or mmap.
+
+    Will return a tuple:
+        (frame_length, profile, sample_rate, channels),
+    or None if there is no valid header."""
+    return _adts_frame(data, offset)
+
+
+def _mpeg_frame(m, offset):
+    """Parse MPEG audio header at offset.
+
+    Will return a tuple:
+        (frame_length, layer, sample_rate, channels, samples_per_frame,
+         bit_rate), or None if there is no valid header."""
+    h = m[offset:offset + 4]
+    if len(h) < 4 or h[0] != 0xff or h[1] & 0xe0 != 0xe0:
+        return None
+    version = (h[1] >> 3) & 0x3
+    layer = 4 - ((h[1] >> 1) & 0x3)
+    bit_rate_index = h[2] >> 4
+    sr_index = (h[2] >> 2) & 0x3
+    if version == 1 or layer == 4 or bit_rate_index in (0, 15) or \
+            sr_index == 3:
+        return None
+    mpeg1 = version == 3
+    bit_rate = MPEG_BIT_RATES[(mpeg1, layer)][bit_rate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sr_index]
+    padding = (h[2] >> 1) & 0x1
+    channels = 1 if h[3] >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bit_rate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        frame_length = 144 * bit_rate // sample_rate + padding
+    else:
+        samples = 576
+        frame_length = 72 * bit_rate // sample_rate + padding
+    return frame_length, layer, sample_rate, channels, samples, bit_rate
+
+
+def _find_frames(m, size, parse_frame):
+    """Find first frame confirmed by the header of the next frame.
+
+    Will return a tuple:
+        (offset, header), or (None, None) if not found in HEAD_SIZE"""
+    offset = id3v2_size(m)
+    end = min(size, offset + HEAD_SIZE)
+    while offset < end:
+        header = parse_frame(m, offset)
+        if header is not None:
+            next_offset = offset + header[0]
+            if next_offset >= size or \
+                    parse_frame(m, next_offset) is not None:
+                return offset, header
+        offset = m.find(b'\xff', offset + 1, end)
+        if offset < 0:
+            break
+    return None, None
+
+
+def _walk_frames(m, size, offset, parse_frame, max_frames=None):
+    """Walk frame headers from offset, skipping ID3 tags and garbage.
+
+    Will yield tuples:
+        (offset, header)"""
+    n = 0
+    while offset < size and (max_frames is None or n < max_frames):
+        header = parse_frame(m, offset)
+        if header is None:
+            tag_size = id3v2_size(m, offset)
+            if tag_size:
+                offset += tag_size
+            else:  # lost sync
+                offset = m.find(b'\xff', offset + 1)
+                if offset < 0:
+                    return
+            continue
+        yield offset, header
+        n += 1
+        offset += header[0]
+
+
+def _parse_adts(m, size, scan):
+    offset, header = _find_frames(m, size, _adts_frame)
+    if offset is None:
+        return None
+    _, profile, sample_rate, channels = header
+    if not channels:  # channel config in PCE, leave it to ffprobe
+        return None
+    frames = 0
+    frame_bytes = 0
+    for _, (frame_length, _, _, _) in _walk_frames(
+            m, size, offset, _adts_frame,
+            None if scan else ESTIMATE_FRAMES):
+        frames += 1
+        frame_bytes += frame_length
+    frame_duration = 1024.0 / sample_rate
+    bit_rate = frame_bytes * 8 / (frames * frame_duration)
+    if scan:
+        duration = frames * frame_duration
+    else:
+        duration = (size - offset) * 8 / bit_rate
+    return _track('aac', 'aac', sample_rate, channels,
+                  bit_rate, duration, profile)
+
+
+def _parse_mpeg(m, size, scan):
+    offset, header = _find_frames(m, size, _mpeg_frame)
+    if offset is None:
+        return None
+    _, layer, sample_rate, channels, samples, bit_rate = header
+    audio_size = size - offset
+    if m[size - 128:size - 125] == b'TAG':  # ID3v1
+        audio_size -= 128
+
+    # Xing / Info or VBRI header in the first frame
+    n_frames = None
+    side_info = (32 if channels == 2 else 17) if sample_rate >= 32000 \
+        else (17 if channels == 2 else 9)
+    xing = offset + 4 + side_info
+    if m[xing:xing + 4] in (b'Xing', b'Info'):
+        flags, = struct.unpack('>I', m[xing + 4:xing + 8])
+        if flags & 0x1:
+            n_frames, = struct.unpack('>I', m[xing + 8:xing + 12])
+    elif m[offset + 36:offset + 40] == b'VBRI':
+        n_frames, = struct.unpack('>I', m[offset + 50:offset + 54])
+
+    if n_frames:
+        duration = n_frames * samples / float(sample_rate)
+        bit_rate = audio_size * 8 / duration
+    elif scan:
+        frames = 0
+        frame_bytes = 0
+        for _, header in _walk_frames(m, size, offset, _mpeg_frame):
+            frames += 1
+            frame_bytes += header[0]
+        duration = frames * samples / float(sample_rate)
+        bit_rate = frame_bytes * 8 / duration
+    else:  # assume constant bitrate
+        duration = audio_size * 8 / float(bit_rate)
+    return _track('mp{}'.format(layer), 'mp3', sample_rate, channels,
+                  bit_rate, duration)
+
+
+ADTSFrame = collections.namedtuple(
+    'ADTSFrame', 'offset length sample_rate channels')
+
+
+class ADTSIndex(object):
+
+    """Frames of an ADTS file, found by walking frame headers.
+
+    Frames are kept in arrays, ID3v2 tags between frames in tags as
+    (offset, size) tuples, garbage bytes are skipped."""
+
+    _cache = collections.OrderedDict()  # indexes keyed by path
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path, max_frames=None):
+        """Index.
+
+        :param path: path of ADTS file
+        :param max_frames: stop after this number of frames,
+            None to index the whole file"""
+        self.path = path
+        self._max_frames = max_frames
+        self.size = os.path.getsize(path)
+        self.offsets = array('q')
+        self.lengths = array('H')  # 13 bits of frame length
+        self.sample_rates = array('i')
+        self.channels = array('B')
+        self.tags = []
+        if self.size:
+            with open(path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._walk(m)
+                finally:
+                    m.close()
+
+    @classmethod
+    def of_file(cls, path, cache_size=INDEX_CACHE_SIZE):
+        """Get index of path, cached until size or mtime of path changes."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime)
+        with cls._cache_lock:
+            cached = cls._cache.pop(path, None)
+        if cached is None or cached[0] != key:
+            cached = key, cls(path)
+        with cls._cache_lock:
+            cls._cache[path] = cached
+            while len(cls._cache) > cache_size:
+                cls._cache.popitem(last=False)
+        return cached[1]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        return ADTSFrame(self.offsets[i], self.lengths[i],
+                         self.sample_rates[i], self.channels[i])
+
+    def __iter__(self):
+        return (ADTSFrame(*frame) for frame in zip(
+            self.offsets, self.lengths, self.sample_rates, self.channels))
+
+    def _walk(self, m):
+        size = self.size
+        offset = 0
+        while offset < size:
+            if len(self.offsets) == self._max_frames:
+                return
+            header = _adts_frame(m, offset)
+            if header is not None and (
+                    len(self.offsets) or _confirmed(m, size, offset, header)):
+                frame_length, _, sample_rate, channels = header
+                self.offsets.append(offset)
+                self.lengths.append(frame_length)
+                self.sample_rates.append(sample_rate)
+                self.channels.append(channels)
+                offset += frame_length
+                continue
+            tag_size = _inline_tag_size(m, size, offset)
+            if tag_size:
+                self.tags.append((offset, tag_size))
+                offset += tag_size
+                continue
+            # lost sync, next frame confirmed by the header after it
+            offset = m.find(b'\xff', offset + 1)
+            while offset >= 0:
+                header = _adts_frame(m, offset)
+                if header is not None and \
+                        _confirmed(m, size, offset, header):
+                    break
+                offset = m.find(b'\xff', offset + 1)
+            if offset < 0:
+                return
+
+
+def _confirmed(m, size, offset, header):
+    """If frame at offset is followed by another frame or end of file."""
+    next_offset = offset + header[0]
+    return next_offset >= size or _adts_frame(m, next_offset) is not None
+
+
+def _inline_tag_size(m, size, offset):
+    """Size of ID3v2 tag at offset of an ADTS file, 0 if no tag.
+
+    Some taggers write plain instead of syncsafe sizes, the one
+    followed by a frame or end of file is taken."""
+    tag_size = id3v2_size(m, offset)
+    if not tag_size:
+        return 0
+    footer = 10 if bytearray(m[offset + 5:offset + 6])[0] & 0x10 else 0
+    plain = 10 + struct.unpack('>I', m[offset + 6:offset + 10])[0] + footer
+    for candidate in (tag_size, plain):
+        end = offset + candidate
+        if end == size or (end < size and _adts_frame(m, end) is not None):
+            return candidate
+    return tag_size
@@ -1,17 +1,36 @@
 #! /usr/bin/env python3
 
+import collections
+import contextlib
+import hashlib
+import itertools
+import math
 import logging
 import json
 import os
+import re
+import signal
 import argparse
 import time
 import pprint
+import queue
 import shlex
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 from cocommon.utils import tricks
 from cocommon.utils.compat import subprocess
 from cocommon.quick_config import config_log
 
+from aucommon import audioheaders
+from aucommon import hoststats
+from aucommon import httpfeed
+from aucommon import pcmanalysis
+from aucommon import probecache
+
 WEIGHT_OF_CODEC = {
     'aac': 1.2,
     'vorbis': 1.2,
@@ -25,12 +44,407 @@ TIME_PUNISHMENT = 100
 LOUDNESS_MIN = -16
 LOUDNESS_MAX = -12
 LOUDNESS_TAR = -14
+SILENT_VOLUME = -70.0  # mean volume (dB) of tracks taken as silent
+MAX_LINE_LENGTH = 4096  # longer lines of ffmpeg output are split
+ENGINES = ('ffmpeg', 'numpy')
+PCM_SAMPLE_RATE = 48000  # decoded sample rate if unknown from probing
+PCM_CHUNK_SIZE = 1 << 16
+ADAPTIVE_TOLERANCE = 0.5  # dB / LU
+ADAPTIVE_WINDOW = 2  # seconds estimates must stay within tolerance
+ADAPTIVE_MIN_LEN = 3  # min seconds to analyze in adaptive mode
+SEGMENT_LEN = 10  # seconds of each window of segment-sampled analysis
+ABSOLUTE_GATE = -70.0  # LUFS, windows below are not taken into loudness
+RELATIVE_GATE = -10.0  # LU below loudness of windows above absolute gate
+FAST_PROBESIZE = 32768  # bytes read by the fast tier of probing
+FAST_ANALYZEDURATION = 500000  # microseconds analyzed by the fast tier
+# fast tier is escalated to full tier if any of these is unknown,
+# duration only for local files
+TIERED_FIELDS = ('bit_rate', 'sample_rate', 'channels', 'duration')
+BATCH_PENDING_FACTOR = 2  # urls pending per job of batch probing
+EXIT_SOME_FAILED = 1  # exit codes of auprobe, 2 is for bad arguments
+EXIT_ALL_FAILED = 3
+SPOOL_TTL = 3600  # seconds captures in spool_dir are reused
+EBUR128_FRAME_RE = re.compile(r'\b(t|M|S|I|LRA):\s*(-?\d+(?:\.\d+)?)')
 
 
 class InvalidURL(Exception):
     pass
 
 
+class _RaceLost(Exception):
+    pass
+
+
+class _ProtocolRace(object):
+
+    """Children of protocols probed in parallel.
+
+    Once finished, all running children are killed
+    and no more children can be started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._finished = False
+
+    def check_output(self, cmd, timeout=None):
+        """subprocess.check_output which can be killed by finish()."""
+        with self._lock:
+            if self._finished:
+                raise _RaceLost()
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            self._procs.add(proc)
+        try:
+            output, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            with self._lock:
+                self._procs.discard(proc)
+        if proc.returncode:
+            with self._lock:
+                if self._finished:
+                    raise _RaceLost()
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+        return output
+
+    def finish(self):
+        """Kill all running children."""
+        with self._lock:
+            self._finished = True
+            for proc in self._procs:
+                proc.kill()
+
+
+class _Hedge(object):
+
+    """subprocess.check_output hedged by a second child.
+
+    A second child of the same command is started once the first one
+    has run for <delay> seconds, output of the first successful child
+    is taken and the other one is killed."""
+
+    def __init__(self, delay):
+        self._delay = delay
+        self.hedged = False  # if the second child was started
+
+    def check_output(self, cmd, timeout=None):
+        results = queue.Queue()
+        procs = []
+
+        def start():
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            procs.append(proc)
+            thread = threading.Thread(
+                target=lambda: results.put((proc, proc.communicate()[0])))
+            thread.daemon = True
+            thread.start()
+
+        start_time = time.time()
+        start()
+        finished = 0
+        try:
+            while True:
+                now = time.time()
+                wait = None
+                if timeout is not None:
+                    wait = start_time + timeout - now
+                if not self.hedged:
+                    hedge_wait = start_time + self._delay - now
+                    wait = hedge_wait if wait is None \
+                        else min(wait, hedge_wait)
+                try:
+                    proc, output = results.get(
+                        timeout=max(0, wait) if wait is not None else None)
+                except queue.Empty:
+                    if timeout is not None and \
+                            time.time() - start_time >= timeout:
+                        raise subprocess.TimeoutExpired(cmd, timeout)
+                    self.hedged = True
+                    start()
+                    continue
+                finished += 1
+                if not proc.returncode:
+                    return output
+                if finished == len(procs):  # no child left running
+                    raise subprocess.CalledProcessError(
+                        proc.returncode, cmd, output)
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+
+
+class _ProtocolProbing(object):
+
+    """Repeats and retries of probing a protocol.
+
+    Shared by the threaded and the asyncio prober: attempts() yields
+    attempts to run, and the caller reports each of them with
+    succeeded() or failed()."""
+
+    def __init__(self, prober, proto):
+        self._prober = prober
+        self._proto = proto
+        self._json_data = None
+        self._probing_time = []
+        self._start_time = None
+        self._done = False
+        self._error = None
+
+    def attempts(self):
+        """Yield tuples of attempts to run:
+            (retry, timeout)
+        A failed repeat is punished with TIME_PUNISHMENT."""
+        prober = self._prober
+        for _ in range(prober._repeat_times):
+            self._done = False
+            self._error = None
+            for retry in range(prober._retry_times):
+                self._start_time = time.time()
+                yield retry, prober._probe_timeout(retry, self._proto)
+                if self._done:
+                    break
+            if not self._done:
+                self._punish()
+
+    def succeeded(self, json_data, start_time=None):
+        """Report ffprobe output of the attempt.
+
+        :param start_time: when the answering child was started,
+            start of the attempt if None"""
+        if start_time is None:
+            start_time = self._start_time
+        con_time = time.time() - start_time
+        self._prober._record_history(self._proto, con_time)
+        self._json_data = json_data
+        self._probing_time.append(con_time)
+        self._done = True
+
+    def failed(self, error):
+        self._prober._record_history(self._proto, None)
+        self._error = error
+
+    def _punish(self):
+        error = self._error
+        if isinstance(error, subprocess.CalledProcessError):
+            self._prober._logger.warning('Called Process Error: %s', error)
+        elif isinstance(error, subprocess.TimeoutExpired):
+            self._prober._logger.warning('Timeout Expired: %s', error.cmd)
+        elif error is not None:
+            raise error
+        self._probing_time.append(TIME_PUNISHMENT)
+
+    def result(self):
+        return self._prober._protocol_result(
+            self._proto, self._json_data, self._probing_time)
+
+
+class _Watchdog(object):
+
+    """Kill a child after timeout."""
+
+    def __init__(self, proc, timeout):
+        self._proc = proc
+        self._timer = None
+        self.timed_out = False
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._kill)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _kill(self):
+        self.timed_out = True
+        self._proc.kill()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class ConvergenceTracker(object):
+
+    """Track running estimates of an analysis.
+
+    Converged when every estimate has stayed within tolerance
+    over the last <window> seconds."""
+
+    def __init__(self, tolerance=ADAPTIVE_TOLERANCE, window=ADAPTIVE_WINDOW,
+                 min_time=ADAPTIVE_MIN_LEN):
+        self._tolerance = tolerance
+        self._window = window
+        self._min_time = max(min_time, window)
+        self._history = {}  # deques of (time, value) keyed by estimate
+        self.time = 0.0  # seconds analyzed
+
+    def update(self, key, t, value):
+        """Update estimate <key> with <value> at <t> seconds."""
+        history = self._history.setdefault(key, collections.deque())
+        history.append((t, value))
+        while history[0][0] < t - self._window:
+            history.popleft()
+        self.time = max(self.time, t)
+
+    @property
+    def spread(self):
+        """Max variation of estimates over the window."""
+        if not self._history:
+            return None
+        return max(max(v for _, v in history) - min(v for _, v in history)
+                   for history in self._history.values())
+
+    @property
+    def converged(self):
+        if self.time < self._min_time or not self._history:
+            return False
+        return self.spread <= self._tolerance
+
+    @property
+    def confidence(self):
+        """100 if estimates did not move over the window, 50 at tolerance."""
+        spread = self.spread
+        if spread is None:
+            return 0.0
+        return round(
+            max(0.0, min(100.0, 100 * (1 - spread / 2.0 / self._tolerance))),
+            1)
+
+
+class AnalysisParser(object):
+
+    """Incremental parser of volumedetect and ebur128 output of ffmpeg.
+
+    Only summaries are kept, per-frame logging is dropped
+    unless on_frame is provided."""
+
+    def __init__(self, module_data, on_frame=None):
+        """Parser.
+
+        :param module_data: a dict keyed by module index of filter graph,
+            modules are updated in place when parsing
+        :param on_frame: called with (module_index, values) for every
+            per-frame line of ebur128, values is a dict keyed by
+            t | M | S | I | LRA"""
+        self._module_data = module_data
+        self._on_frame = on_frame
+        self._pending = set(module_data)
+        self._in_ebur128_summary_flag = False
+        self._current_ebur128_module_index = None
+
+    @property
+    def done(self):
+        """If summaries of all modules have arrived."""
+        return not self._pending
+
+    def feed(self, line):
+        """Parse a line (bytes) of ffmpeg output."""
+        module_data = self._module_data
+        line = line.decode('utf-8', 'ignore').strip()
+        # if line is not in a summary of ebur128, skip
+        if not self._in_ebur128_summary_flag and not line.startswith('['):
+            return
+        if self._in_ebur128_summary_flag and \
+                line.startswith('I:') and line.endswith('LUFS'):
+            index = self._current_ebur128_module_index
+            module_data[index]['loudness'] = float(line.split()[-2])
+            self._pending.discard(index)
+            self._in_ebur128_summary_flag = False
+            self._current_ebur128_module_index = None
+        elif line.startswith('[Parsed_ebur128_') and 'Summary' in line:
+            self._current_ebur128_module_index = int(
+                line.split()[0].split('_')[-1])
+            self._in_ebur128_summary_flag = True
+        elif line.startswith('[Parsed_ebur128_') and ' t:' in line:
+            if self._on_frame is not None:
+                values = dict((k, float(v))
+                              for k, v in EBUR128_FRAME_RE.findall(line))
+                if 't' in values:
+                    self._on_frame(
+                        int(line.split()[0].split('_')[-1]), values)
+
+        elif line.startswith('[Parsed_volumedetect_') and \
+                'mean_volume' in line:
+            line_split = line.split()
+            index = int(line_split[0].split('_')[-1])
+            module_data[index]['volume_mean'] = float(line_split[-2])
+            self._check_volumedetect(index)
+        elif line.startswith('[Parsed_volumedetect_') and \
+                'max_volume' in line:
+            line_split = line.split()
+            index = int(line_split[0].split('_')[-1])
+            module_data[index]['volume_max'] = float(line_split[-2])
+            self._check_volumedetect(index)
+
+    def _check_volumedetect(self, index):
+        data = self._module_data[index]
+        if data['volume_mean'] is not None and \
+                data['volume_max'] is not None:
+            self._pending.discard(index)
+
+    def result(self, track=None):
+        """Get volume and loudness keyed by channel.
+
+        :param track: only modules of track index <track>,
+            for graphs covering several tracks
+        Will return a tuple:
+            (volume, loudness)"""
+        volume = {}
+        loudness = {}
+        for k, v in self._module_data.items():
+            if track is not None and v.get('track') != track:
+                continue
+            if v['name'] == 'volumedetect':
+                volume[v['channel']] = {
+                    'volume_max': v['volume_max'],
+                    'volume_mean': v['volume_mean']}
+            elif v['name'] == 'ebur128':
+                loudness[v['channel']] = v['loudness']
+        return volume, loudness
+
+
+def track_health(volume, loudness, channels):
+    """Judge audio health of a track from its volume and loudness.
+
+    Flags are the same as abnormals of probing results, plus silent and
+    broken (summaries missing). A track is healthy if neither.
+    Volumes are clamped to VOLUME_MIN first, volumedetect reports
+    -inf dB for some silent tracks, and a track is silent if its mean
+    volume is at most SILENT_VOLUME or its loudness at most the
+    absolute gate, where ebur128 reports silence.
+    Will return a dict of flags."""
+    ori = volume.get(CHANNEL_ORI) or {}
+    broken = ori.get('volume_mean') is None or \
+        loudness.get(CHANNEL_ORI) is None
+    health = {
+        'broken': broken,
+        'silent': False,
+        'inverted': False,
+        'll': False,
+        'rr': False,
+        'too_loud': False,
+        'too_low': False,
+        }
+    if not broken:
+        mean = max(ori['volume_mean'], pcmanalysis.VOLUME_MIN)
+        health['silent'] = mean <= SILENT_VOLUME or \
+            loudness[CHANNEL_ORI] <= ABSOLUTE_GATE
+        health['too_loud'] = ori['volume_max'] == 0.0
+        health['too_low'] = mean <= -30.0
+        means = dict((channel, (volume.get(channel) or {}).get('volume_mean'))
+                     for channel in (0, 1, CHANNEL_MERGED))
+        if channels == 2 and None not in means.values():
+            means = dict((channel, max(v, pcmanalysis.VOLUME_MIN))
+                         for channel, v in means.items())
+            health['ll'] = means[1] + 7 <= means[0]
+            health['rr'] = means[0] + 7 <= means[1]
+            health['inverted'] = not health['ll'] and not health['rr'] and \
+                means[CHANNEL_MERGED] + 7 <= mean
+    health['healthy'] = not broken and not health['silent']
+    return health
+
+
 class AudioProber(object):
 
     """Audio Prober for local files and urls (only for ffprobe).
@@ -41,7 +455,14 @@ class AudioProber(object):
 
     def __init__(self, url, input_options=[],
                  repeat_times=3, timeout=10, retry_times=5,
-                 min_len=10, max_len=20, force_proto=False):
+                 min_len=10, max_len=20, force_proto=False,
+                 race_protocols=False, cache=None, spool=False,
+                 spool_dir=None, spool_ttl=SPOOL_TTL,
+                 engine='ffmpeg', adaptive=False,
+                 tolerance=ADAPTIVE_TOLERANCE, instrument=None,
+                 history=None, hedge=False, tiered=False,
+                 parse_headers=False, scan_headers=False, http_pool=None,
+                 all_tracks=False, segments=0, segment_len=SEGMENT_LEN):
         """Prober.
 
         Volume and loudness are only for the best_track.
@@ -52,7 +473,48 @@ class AudioProber(object):
         :param timeout: timeout of probing
         :param retry_times: times of retries to try probing
         :param min_len: min length to get volume / loudness of input
-        :param max_len: max length to get volume / loudness of input."""
+        :param max_len: max length to get volume / loudness of input
+        :param force_proto: use scheme in url as proto
+        :param race_protocols: probe possible protocols in parallel
+        :param cache: a probecache.ProbeCache to reuse probing results
+        :param spool: capture best track of url into a local file and
+            analyze the capture, so analysis does not connect to url
+            again; probing protocols still connects as usual
+        :param spool_dir: keep captures in this directory, keyed by url,
+            input options, protocol, track and length, and reuse them
+            instead of capturing again; with cache, reruns with other
+            analysis options do not connect to url at all
+        :param spool_ttl: seconds captures in spool_dir are reused
+        :param engine: ffmpeg | numpy, numpy decodes best track once
+            and analyzes raw PCM instead of filtering it in ffmpeg
+        :param adaptive: stop analysis once running estimates converge
+        :param tolerance: max variation (dB / LU) of converged estimates
+        :param instrument: called with a dict for every event of probing,
+            like metrics.ProbeMetrics.
+        :param history: a hoststats.HostHistory of connection times,
+            to adapt timeouts to the host
+        :param hedge: start a second ffprobe once the first one runs
+            longer than p95 of the host in history
+        :param tiered: probe audio streams with small probesize first,
+            and all streams with default probesize only if fields of
+            TIERED_FIELDS are unknown
+        :param parse_headers: parse local ADTS, MPEG audio, WAV, FLAC
+            and Ogg Vorbis files in python instead of spawning ffprobe,
+            see audioheaders
+        :param scan_headers: with parse_headers, walk all frames of ADTS
+            and MPEG audio for exact duration and bitrate instead of
+            estimating them from the first frames and file size
+        :param http_pool: a httpfeed.SessionPool, to fetch http urls
+            once over a pooled connection and feed them to ffprobe and
+            ffmpeg through stdin, falling back to urls if ffprobe can not
+            tell tracks from the first bytes
+        :param all_tracks: analyze every audio track in one ffmpeg run
+            and prefer healthy tracks when selecting best track,
+            only with ffmpeg engine and without spool
+        :param segments: analyze <segments> evenly spaced windows of
+            local files longer than all windows, in parallel, instead
+            of decoding from the start, only with ffmpeg engine
+        :param segment_len: seconds of each window"""
 
         self._url = url
         self._repeat_times = repeat_times
@@ -61,22 +523,57 @@ class AudioProber(object):
         self._min_len = min_len
         self._max_len = max_len
         self._force_proto = force_proto
+        self._race_protocols = race_protocols
+        self._cache = cache
+        self._spool = spool
+        self._spool_dir = spool_dir
+        self._spool_ttl = spool_ttl
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine {}'.format(engine))
+        self._engine = engine
+        self._adaptive = adaptive
+        if all_tracks and (engine != 'ffmpeg' or spool):
+            raise ValueError('all_tracks needs ffmpeg engine without spool')
+        self._all_tracks = all_tracks
+        if segments and (engine != 'ffmpeg' or all_tracks):
+            raise ValueError('segments needs ffmpeg engine of best track')
+        self._segments = segments
+        self._segment_len = segment_len
+        self._tolerance = tolerance
+        self._instrument = instrument
+        self._history = history
+        self._hedge = hedge
+        self._tiered = tiered
+        self._parse_headers = parse_headers
+        self._scan_headers = scan_headers
+        self._http_pool = http_pool
+        self._feed = None  # a httpfeed.HTTPFeed if tracks probed from it
 
         self.input_options = input_options
 
         self.inverted_confidence = None
         self.ll_confidence = None
         self.rr_confidence = None
+        self.analysis_confidence = None  # only for adaptive analysis
+        # volume, loudness and health keyed by track index, only for
+        # analysis of all tracks
+        self.track_analysis = None
 
         self._proto = None
         self._tracks = None  # a dict keyed of track-index
         self._con_time = None
         self._best_track_index = None
         self._tested_duration = None
+        self._probe_tiers = {}  # tier which answered keyed by proto
+        self.probe_tier = None  # tier which answered for selected proto
 
         self._volume = None
         self._loudness = None
 
+        self._spool_path = None
+        self._spool_track = None  # the only track of spool file
+        self._spool_kept = False  # spool file kept in spool_dir
+
         self._logger = logging.getLogger(__name__)
 
         if '://' not in self._url:  # local file
@@ -96,6 +593,104 @@ class AudioProber(object):
     def __str__(self):
         return pprint.pformat(vars(self))
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Remove spool file if any and not kept in spool_dir,
+        close http feed if any."""
+        if self._feed is not None:
+            self._feed.close()
+            self._feed = None
+        if self._spool_path is not None:
+            if not self._spool_kept:
+                try:
+                    os.remove(self._spool_path)
+                except OSError:
+                    pass
+            self._spool_path = None
+            self._spool_track = None
+            self._spool_kept = False
+
+    @property
+    def host(self):
+        """Host of url, empty for local files."""
+        return self.host_of(self._url)
+
+    @staticmethod
+    def host_of(url):
+        """Host of url, empty for local files."""
+        if '://' not in url:
+            return ''
+        return urlsplit('//' + url.split('://', 1)[1]).hostname or ''
+
+    @staticmethod
+    def connections_of(url, force_proto=False, race_protocols=False,
+                       hedge=False, **kwargs):
+        """Max number of connections to host of url opened at the same
+        time by a prober of url with these arguments.
+
+        Racing opens one connection per possible protocol, hedging
+        doubles each of them."""
+        connections = 1
+        if race_protocols and '://' in url:
+            connections = max(1, len(protocols_of(
+                url.split('://', 1)[0], force_proto)))
+        if hedge:
+            connections *= 2
+        return connections
+
+    def _emit(self, stage, **fields):
+        """Emit an event to instrument."""
+        if self._instrument is None:
+            return
+        fields['stage'] = stage
+        fields['url'] = self._url
+        fields['host'] = self.host
+        try:
+            self._instrument(fields)
+        except Exception:
+            self._logger.exception('Instrument failed on %s', fields)
+
+    @contextlib.contextmanager
+    def _measure(self, stage, **fields):
+        """Time the block and emit an event of <stage> with its outcome.
+
+        Fields can be added to the yielded dict inside the block."""
+        event = dict(fields)
+        start_time = time.time()
+        try:
+            yield event
+        except subprocess.TimeoutExpired:
+            event['outcome'] = 'timeout'
+            raise
+        except subprocess.CalledProcessError as e:
+            event['outcome'] = 'error'
+            event['exit_code'] = e.returncode
+            raise
+        except _RaceLost:
+            event['outcome'] = 'lost'
+            raise
+        except BaseException:
+            event['outcome'] = 'error'
+            raise
+        else:
+            event['outcome'] = 'ok'
+            event.setdefault('exit_code', 0)
+        finally:
+            event['elapsed'] = time.time() - start_time
+            self._emit(stage, **event)
+
+    @property
+    def spool_path(self):
+        """Local capture of best track, None if not spooled."""
+        if self._spool_track is None:
+            return None
+        return self._spool_path
+
     @property
     def output_options(self):
         output_options = []
@@ -198,24 +793,10 @@ class AudioProber(object):
         http or mmsh for http
 
         :param repeat_times: times to repeat the test"""
-
-        proto = self._ori_proto.replace(
-            'rtspt', 'rtsp').replace('rtmpt', 'rtmp')
-
-        # list possible protos
-        if self._force_proto:
-            return [proto]
-        elif proto == 'file':
-            return ['file']
-        elif proto == 'rtmp':
-            return ['rtmp']
-        elif proto == 'http':
-            return ['http', 'mmsh']
-        elif proto in ['mms', 'mmsh', 'mmst', 'rtsp']:
-            return ['rtsp', 'mmsh']
-        else:
-            self._logger.warning("Protocol %s not supported", proto)
-            return []
+        protocols = protocols_of(self._ori_proto, self._force_proto)
+        if not protocols:
+            self._logger.warning("Protocol %s not supported", self._ori_proto)
+        return protocols
 
     @property
     def tracks(self):
@@ -281,64 +862,235 @@ class AudioProber(object):
             Threshold: -47.5 LUFS
             LRA low:   -28.0 LUFS
             LRA high:  -27.2 LUFS"""
-        self._tested_duration = self.best_track['duration']
+        if self._load_cached_analysis():
+            return
 
-        if self._tested_duration < self._min_len:
-            self._tested_duration = self._min_len
-        elif self._proto != 'file' and self._tested_duration > self._max_len:
-            self._tested_duration = self._max_len
+        if self._need_spool():
+            try:
+                if not self._find_spool():
+                    cmd, timeout = self._prepare_spool()
+                    with self._measure('spool', proto=self._proto,
+                                       timeout=timeout) as event:
+                        subprocess.check_output(
+                            cmd, timeout=timeout, stderr=subprocess.STDOUT)
+                        event['bytes'] = os.path.getsize(self._spool_path)
+                    self._keep_spool()
+                self._load_spool(subprocess.check_output(
+                    self._probe_cmd('file', self._spool_path)))
+            except Exception:
+                self.close()
+                raise
+
+        if self._need_segments():
+            with self._measure('analysis', proto=self._proto,
+                               engine=self._engine,
+                               segments=self._segments) as event:
+                event['output_bytes'] = self._run_segment_analysis()
+                event['tested_duration'] = self._tested_duration
+            self._store_cached_analysis()
+            return
+
+        if self._engine == 'numpy':
+            cmd, analyzer, timeout = self._prepare_pcm_analysis()
+        else:
+            cmd, module_data, timeout = self._prepare_analysis()
+        with self._measure('analysis', proto=self._proto,
+                           engine=self._engine, timeout=timeout) as event:
+            if self._engine == 'numpy':
+                event['output_bytes'] = self._run_pcm_analysis(
+                    cmd, analyzer, timeout)
+            else:
+                event['output_bytes'] = self._run_analysis(
+                    cmd, module_data, timeout)
+            event['tested_duration'] = self._tested_duration
+        self._store_cached_analysis()
+
+    def _prepare_pcm_analysis(self):
+        """Prepare ffmpeg command to decode best track to raw float PCM.
+
+        Will return a tuple:
+            (cmd, analyzer, timeout)"""
+        if self._spool_track is None:
+            self._set_tested_duration()
+        url, input_options, index = self._analysis_input()
+
+        cmd = ['ffmpeg', '-nostats', '-loglevel', 'error',
+               '-t', str(self._tested_duration)] + input_options + \
+            ['-i', url, '-map', '0:{}'.format(index)]
+        sample_rate = self.best_track['sample_rate']
+        if sample_rate == NONEXIST:
+            sample_rate = PCM_SAMPLE_RATE
+            cmd += ['-ar', str(sample_rate)]
+        channels = self.best_track['channels']
+        if channels == NONEXIST:
+            channels = 2
+            cmd += ['-ac', str(channels)]
+        cmd += ['-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+        timeout = self._analysis_timeout()
+        self._logger.info(
+            'Decoding best track %s of %s for analysis, '
+            'length: %s, timeout: %s',
+            pprint.pformat(self.best_track),
+            url,
+            self._tested_duration,
+            timeout)
+        return cmd, pcmanalysis.PCMAnalyzer(sample_rate, channels), timeout
+
+    def _run_pcm_analysis(self, cmd, analyzer, timeout):
+        """Run ffmpeg and analyze its PCM output block by block.
+
+        Will return number of bytes of output read."""
+        tracker = self._new_tracker()
+        proc = subprocess.Popen(cmd, stdin=self._analysis_stdin(),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        self._pump_feed(proc)
+        watchdog = _Watchdog(proc, timeout)
+        converged = False
+        bytes_read = 0
+        try:
+            for data in iter(
+                    lambda: proc.stdout.read(PCM_CHUNK_SIZE), b''):
+                bytes_read += len(data)
+                analyzer.feed(data)
+                if tracker is not None:
+                    self._update_pcm_tracker(tracker, analyzer)
+                    if tracker.converged:
+                        converged = True
+                        break
+        finally:
+            watchdog.cancel()
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+        if watchdog.timed_out:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if proc.returncode and not converged:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        self._volume, self._loudness = analyzer.result()
+        self._finish_tracker(tracker)
+        return bytes_read
+
+    def _prepare_analysis(self, start=None, length=None):
+        """Prepare ffmpeg command to get volume and loudness of best track,
+        or of every audio track if all_tracks.
+
+        :param start: seek input to <start> seconds and analyze <length>
+            seconds, instead of tested_duration from the start
+        Will return a tuple:
+            (cmd, module_data, timeout)"""
+        if self._spool_track is None:
+            self._set_tested_duration()
+        url, input_options, index = self._analysis_input()
+        indexes = sorted(self.tracks) if self._all_tracks else [index]
 
-        index = self.best_track['index']
         # a filter_complex graph to get volume and loudness of each channel
-        filter_complex_list = ['[0:{}]volumedetect,ebur128[cfull]'.format(
-            index)]
+        filter_complex_list = []
         # module_data indexed by module index
-        module_data = {
-            0: {'name': 'volumedetect',
-                'channel': CHANNEL_ORI,
-                'volume_mean': None,
-                'volume_max': None,
-                },
-            1: {'name': 'ebur128',
-                'channel': CHANNEL_ORI,
-                'loudness': None,
-                },
-            }
+        module_data = {}
+        labels = []
+        module_index = 0
+        for track_index in indexes:
+            module_index = self._add_track_filters(
+                track_index, self.tracks[track_index]['channels'],
+                module_index, filter_complex_list, module_data, labels)
+
+        if start is None:
+            cmd = ['ffmpeg', '-nostats', '-t', str(self._tested_duration)]
+        else:
+            cmd = ['ffmpeg', '-nostats', '-ss', str(start), '-t', str(length)]
+        cmd += input_options + \
+            ['-i', url,
+             '-filter_complex', ';'.join(filter_complex_list)]
+        for label in labels:
+            cmd += ['-map', '[{}]'.format(label), '-f', 'null', '-']
 
-        for i in range(self.best_track['channels']):
-            filter_complex_list.append(
-                '[0:{}]pan=mono|c0=c{},volumedetect,ebur128[c{}]'.format(
-                    index, i, i))
-            # pan, volumedetect and ebur128 are 3 modules
-            module_data[1 + 3 * i + 2] = {
-                'name': 'volumedetect',
-                'channel': i,
-                'volume_mean': None,
-                'volume_max': None,
-                }
-            module_data[1 + 3 * i + 3] = {
-                'name': 'ebur128',
-                'channel': i,
-                'loudness': None,
-                }
+        timeout = self._analysis_timeout()
+        self._logger.info(
+            'Checking volume and loudness of best track %s of %s, '
+            'length: %s, timeout: %s',
+            pprint.pformat(self.best_track),
+            url,
+            self._tested_duration,
+            timeout)
 
-        # if stereo, add inversion check
-        if self.best_track['channels'] == 2:
+        return cmd, module_data, timeout
+
+    def _add_track_filters(self, index, channels, module_index,
+                           filter_complex_list, module_data, labels):
+        """Add filter chains of track <index> to filter graph.
+
+        volumedetect and ebur128 of the track, each of its channels,
+        and of the mid-mix if stereo.
+        filter_complex_list, module_data and labels are updated in place.
+        Will return module index following the added modules."""
+        prefix = 't{}'.format(index) if self._all_tracks else ''
+        # (pan, channel, label) of chains, whole track is not panned
+        chains = [(None, CHANNEL_ORI, 'cfull')]
+        for i in range(channels):
+            chains.append(('c{}'.format(i), i, 'c{}'.format(i)))
+        if channels == 2:  # if stereo, add inversion check
+            chains.append(('0.5*c0+0.5*c1', CHANNEL_MERGED, 'cinverted'))
+
+        for pan, channel, label in chains:
+            pan_filter = ''
+            if pan is not None:
+                pan_filter = 'pan=mono|c0={},'.format(pan)
             filter_complex_list.append(
-                '[0:{}]pan=mono|c0=0.5*c0+0.5*c1'
-                ',volumedetect,ebur128[cinverted]'.format(
-                    index))
-            module_data[1 + 3 * self.best_track['channels'] + 2] = {
+                '[0:{}]{}volumedetect,ebur128[{}{}]'.format(
+                    index, pan_filter, prefix, label))
+            labels.append(prefix + label)
+            if pan is not None:  # pan is a module too
+                module_index += 1
+            module_data[module_index] = {
                 'name': 'volumedetect',
-                'channel': CHANNEL_MERGED,
+                'track': index,
+                'channel': channel,
                 'volume_mean': None,
                 'volume_max': None,
                 }
-            module_data[1 + 3 * self.best_track['channels'] + 3] = {
+            module_data[module_index + 1] = {
                 'name': 'ebur128',
-                'channel': CHANNEL_MERGED,
+                'track': index,
+                'channel': channel,
                 'loudness': None,
                 }
+            module_index += 2
+        return module_index
+
+    def _set_tested_duration(self):
+        self._tested_duration = self.best_track['duration']
+
+        if self._tested_duration < self._min_len:
+            self._tested_duration = self._min_len
+        elif self._proto != 'file' and self._tested_duration > self._max_len:
+            self._tested_duration = self._max_len
+
+    def _analysis_timeout(self):
+        if self._timeout is None or self._spool_track is not None:
+            return None
+        timeout = max(self._timeout, self._con_time * 2)
+        if self._history is not None:
+            stats = self._history.stats(self._history_key(self._proto))
+            if stats is not None:  # slow hosts get more time to connect
+                timeout = max(timeout, stats['p95'] * 2)
+        if self.best_track['duration'] == 0.0:  # live stream
+            timeout = max(self._tested_duration, timeout)
+        return timeout
+
+    def _analysis_input(self):
+        """Get input of best track for ffmpeg.
+
+        Will return a tuple:
+            (url, input_options, track_index)"""
+        if self._spool_track is not None:
+            return self._spool_path, [], self._spool_track['index']
+        if self._feed is not None:
+            return 'pipe:0', list(self.input_options), \
+                self.best_track['index']
 
         url = self.best_url
         input_options = list(self.input_options)
@@ -346,165 +1098,579 @@ class AudioProber(object):
             input_options = ['-rtsp_transport', 'tcp'] + input_options
         elif self._proto == 'rtmp':
             url = url + ' live=1'
-
-        cmd = ['ffmpeg', '-t', str(self._tested_duration)] + input_options + \
-            ['-i', url,
-             '-filter_complex', ';'.join(filter_complex_list)] + \
-            ['-map', '[cfull]', '-f', 'null', '-']
-        for i in range(self.best_track['channels']):
-            cmd += ['-map', '[c{}]'.format(i), '-f', 'null', '-']
-        if self.best_track['channels'] == 2:
-            cmd += ['-map', '[cinverted]', '-f', 'null', '-']
-
-        if self._timeout is None:
-            timeout = None
-        else:  # TODO: timeout adjustment
-            timeout = max(self._timeout, self._con_time * 2)
-            if self.best_track['duration'] == 0.0:  # live stream
-                timeout = max(self._tested_duration, timeout)
+        return url, input_options, self.best_track['index']
+
+    def _need_spool(self):
+        """Spool unless input is local or already fed from one
+        connection."""
+        return self._spool and self._spool_track is None and \
+            self._ori_proto != 'file' and self._feed is None
+
+    def _spool_dir_path(self):
+        """Path of capture of best track in spool_dir."""
+        key = '{} {}'.format(self._cache_key('tracks'), json.dumps(
+            [self._proto, self.best_track['index'], self._tested_duration]))
+        return os.path.join(self._spool_dir, 'auprobe_{}.mka'.format(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def _find_spool(self):
+        """Take capture of best track from spool_dir if not expired.
+
+        Will return True if found."""
+        if self._spool_dir is None:
+            return False
+        self._set_tested_duration()
+        path = self._spool_dir_path()
+        try:
+            fresh = time.time() - os.path.getmtime(path) < self._spool_ttl
+        except OSError:
+            fresh = False
+        self._emit('cache', kind='spool', outcome='hit' if fresh else 'miss')
+        if fresh:
+            self._spool_path = path
+            self._spool_kept = True
+        return fresh
+
+    def _prune_spool_dir(self):
+        """Remove expired captures from spool_dir."""
+        expired = time.time() - self._spool_ttl
+        for name in os.listdir(self._spool_dir):
+            if not name.startswith('auprobe_'):
+                continue
+            path = os.path.join(self._spool_dir, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _prepare_spool(self):
+        """Prepare ffmpeg command to capture best track into spool file.
+
+        With spool_dir, the capture is written next to its final path
+        and moved there by _keep_spool, so that other probers never
+        take a partial capture.
+        Will return a tuple:
+            (cmd, timeout)"""
+        self._set_tested_duration()
+        url, input_options, index = self._analysis_input()
+        if self._spool_dir is None:
+            fd, self._spool_path = tempfile.mkstemp(
+                prefix='auprobe_', suffix='.mka')
+        else:
+            os.makedirs(self._spool_dir, exist_ok=True)
+            self._prune_spool_dir()
+            fd, self._spool_path = tempfile.mkstemp(
+                prefix='partial_', suffix='.mka', dir=self._spool_dir)
+        os.close(fd)
+
+        cmd = ['ffmpeg', '-y', '-t', str(self._tested_duration)] + \
+            input_options + \
+            ['-i', url, '-map', '0:{}'.format(index),
+             '-c', 'copy', '-f', 'matroska', self._spool_path]
+        timeout = self._analysis_timeout()
         self._logger.info(
-            'Checking volume and loudness of best track %s of %s, '
-            'length: %s, timeout: %s',
-            pprint.pformat(self.best_track),
-            self.best_url,
-            self._tested_duration,
-            timeout)
-
-        output = subprocess.check_output(
-            cmd, timeout=timeout,
-            stderr=subprocess.STDOUT).splitlines()
+            'Spooling best track %s of %s to %s, length: %s, timeout: %s',
+            index, url, self._spool_path, self._tested_duration, timeout)
+        return cmd, timeout
 
-        in_ebur128_summary_flag = False
-        current_ebur128_module_index = None
-        for line in output:
-            line = line.decode('utf-8', 'ignore').strip()
-            # if line is not in a summary of ebur128, skip
-            if not in_ebur128_summary_flag and not line.startswith('['):
-                continue
-            if in_ebur128_summary_flag and \
-                    line.startswith('I:') and line.endswith('LUFS'):
-                module_data[current_ebur128_module_index][
-                    'loudness'] = float(
-                        line.split()[-2])
-                in_ebur128_summary_flag = False
-                current_ebur128_module_index = None
-            elif line.startswith('[Parsed_ebur128_') and 'Summary' in line:
-                current_ebur128_module_index = int(
-                    line.split()[0].split('_')[-1])
-                in_ebur128_summary_flag = True
-
-            elif line.startswith('[Parsed_volumedetect_') and \
-                    'mean_volume' in line:
-                line_split = line.split()
-                index = int(line_split[0].split('_')[-1])
-                module_data[index]['volume_mean'] = float(line_split[-2])
-            elif line.startswith('[Parsed_volumedetect_') and \
-                    'max_volume' in line:
-                line_split = line.split()
-                index = int(line_split[0].split('_')[-1])
-                module_data[index]['volume_max'] = float(line_split[-2])
+    def _keep_spool(self):
+        """Move finished capture to its path in spool_dir if any."""
+        if self._spool_dir is None:
+            return
+        path = self._spool_dir_path()
+        os.replace(self._spool_path, path)
+        self._spool_path = path
+        self._spool_kept = True
+
+    def _load_spool(self, json_data):
+        """Take track info from ffprobe output of spool file.
+
+        Fields unknown from probing url are filled from the capture."""
+        tracks = self._parse_probe_output(json_data)
+        if not tracks:
+            raise InvalidURL(self._spool_path)
+        self._spool_track = tracks[min(tracks)]
+        best_track = self.best_track
+        for k in ('bit_rate', 'sample_rate', 'channels'):
+            if best_track[k] == NONEXIST:
+                best_track[k] = self._spool_track[k]
+
+    def _run_analysis(self, cmd, module_data, timeout):
+        """Run ffmpeg and parse its output line by line.
+
+        Only the state of summaries is kept, and ffmpeg is stopped
+        as soon as all summaries have arrived.
+        Will return number of bytes of output read."""
+        tracker = self._new_tracker()
+        parser, bytes_read = self._run_analysis_child(
+            cmd, module_data, timeout, tracker)
+        self._set_analysis_result(parser)
+        self._finish_tracker(tracker)
+        return bytes_read
+
+    def _run_analysis_child(self, cmd, module_data, timeout, tracker=None):
+        """Run ffmpeg of analysis until all summaries have arrived.
+
+        Will return a tuple:
+            (parser, bytes_read)"""
+        parser = self._new_parser(module_data, tracker)
+        proc = subprocess.Popen(cmd, stdin=self._analysis_stdin(),
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+        self._pump_feed(proc)
+        watchdog = _Watchdog(proc, timeout)
+        stopping = False
+        bytes_read = 0
+        try:
+            for line in iter(
+                    lambda: proc.stderr.readline(MAX_LINE_LENGTH), b''):
+                bytes_read += len(line)
+                parser.feed(line)
+                if parser.done:
+                    break
+                if not stopping and tracker is not None and \
+                        tracker.converged:
+                    # ffmpeg prints summaries when interrupted
+                    proc.send_signal(signal.SIGINT)
+                    stopping = True
+        finally:
+            watchdog.cancel()
+            if proc.poll() is None:
+                proc.kill()
+            proc.stderr.close()
+            proc.wait()
+
+        if not parser.done:
+            if watchdog.timed_out:
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+        return parser, bytes_read
+
+    def _need_segments(self):
+        return self._segments > 0 and self._ori_proto == 'file' and \
+            self.best_track['duration'] > \
+            self._segments * self._segment_len
+
+    def _segment_starts(self):
+        """Starts of windows centered in <segments> equal parts."""
+        step = self.best_track['duration'] / float(self._segments)
+        return [max(0.0, step * (i + 0.5) - self._segment_len / 2.0)
+                for i in range(self._segments)]
+
+    def _run_segment_analysis(self):
+        """Analyze windows in parallel and aggregate them.
+
+        Will return number of bytes of output read."""
+        jobs = []
+        for start in self._segment_starts():
+            cmd, module_data, timeout = self._prepare_analysis(
+                start, self._segment_len)
+            jobs.append((cmd, module_data, timeout))
+        workers = min(len(jobs), os.cpu_count() or 1)
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(
+                lambda job: self._run_analysis_child(*job), jobs))
+
+        self._volume, self._loudness = aggregate_windows(
+            [(self._segment_len,) + parser.result()
+             for parser, _ in results])
+        self._tested_duration = self._segment_len * len(jobs)
+        return sum(bytes_read for _, bytes_read in results)
+
+    def _set_analysis_result(self, parser):
+        """Take volume and loudness from parser.
+
+        If all tracks are analyzed, best track is selected again
+        preferring healthy tracks."""
+        if not self._all_tracks:
+            self._volume, self._loudness = parser.result()
+            return
 
-        volume = {}
-        loudness = {}
-        for k, v in module_data.items():
-            if v['name'] == 'volumedetect':
-                volume[v['channel']] = {
-                    'volume_max': v['volume_max'],
-                    'volume_mean': v['volume_mean']}
-            elif v['name'] == 'ebur128':
-                loudness[v['channel']] = v['loudness']
-        self._volume = volume
-        self._loudness = loudness
+        self.track_analysis = {}
+        for index in sorted(self.tracks):
+            volume, loudness = parser.result(index)
+            self.track_analysis[index] = {
+                'volume': volume,
+                'loudness': loudness,
+                'health': track_health(
+                    volume, loudness, self.tracks[index]['channels']),
+                }
+        previous = self._best_track_index
+        self._best_track_index = None
+        self._get_best_track()
+        self._emit('health', proto=self._proto,
+                   outcome='kept' if previous == self._best_track_index
+                   else 'switched')
+        best = self.track_analysis[self._best_track_index]
+        self._volume, self._loudness = best['volume'], best['loudness']
+
+    def _analysis_stdin(self):
+        if self._feed is None:
+            return subprocess.DEVNULL
+        return subprocess.PIPE
+
+    def _pump_feed(self, proc):
+        """Feed input of analysis into stdin of proc if fed from http."""
+        if self._feed is not None:
+            self._feed.pump(proc.stdin)
+
+    def _new_tracker(self):
+        if not self._adaptive:
+            return None
+        return ConvergenceTracker(self._tolerance)
+
+    def _new_parser(self, module_data, tracker):
+        """Get parser of module_data, updating tracker with running
+        integrated loudness of every ebur128 module."""
+        if tracker is None:
+            return AnalysisParser(module_data)
+
+        def on_frame(index, values):
+            if 'I' in values:
+                tracker.update(index, values['t'], values['I'])
+
+        return AnalysisParser(module_data, on_frame)
+
+    def _update_pcm_tracker(self, tracker, analyzer):
+        """Update tracker with running loudness and mean volume."""
+        t = analyzer.analyzed_samples / float(analyzer.sample_rate)
+        for signal_index in analyzer.signals:
+            tracker.update(('loudness', signal_index), t,
+                           analyzer.loudness_of(signal_index))
+            if signal_index != CHANNEL_ORI:
+                tracker.update(('volume', signal_index), t,
+                               analyzer.volume_mean_of(signal_index))
+
+    def _finish_tracker(self, tracker):
+        """Record confidence and analyzed duration of adaptive analysis."""
+        if tracker is None:
+            return
+        self.analysis_confidence = tracker.confidence
+        if tracker.converged and tracker.time < self._tested_duration:
+            self._tested_duration = tracker.time
 
     def _get_audio_tracks(self):
         """Probe a url to get all audio tracks.
 
-        Will try every possible protocol for given scheme.
+        Will try every possible protocol for given scheme,
+        one after another, or in parallel if race_protocols.
         Will return a dict:
             {proto: {track_index: track_info}}"""
 
+        if self._load_cached_tracks():
+            return self._tracks
+
+        if self._parse_local_headers():
+            return self._tracks
+
+        if self._probe_http_feed():
+            return self._tracks
+
+        if self._race_protocols and len(self.possible_protocols) > 1:
+            return self._race_audio_tracks()
+
         streams = {}
         for proto in self.possible_protocols:
-            if proto == 'file':
-                url = self._url
+            streams[proto] = self._probe_protocol(proto)
+        return self._select_protocol(streams)
+
+    def _parse_local_headers(self):
+        """Parse tracks of a local file without ffprobe if supported."""
+        if not self._parse_headers or self._ori_proto != 'file':
+            return False
+        start_time = time.time()
+        tracks = audioheaders.probe_file(self._url,
+                                         scan=self._scan_headers)
+        self._emit('headers', proto='file',
+                   elapsed=time.time() - start_time,
+                   outcome='ok' if tracks is not None else 'unsupported')
+        if tracks is None:
+            return False
+        self._probe_tiers['file'] = 'headers'
+        self._select_protocol({'file': {
+            'proto': 'file',
+            'con_time': time.time() - start_time,
+            'tracks': tracks,
+            }})
+        return True
+
+    def _probe_http_feed(self):
+        """Probe tracks from the first bytes of url over a pooled
+        connection, which is kept to feed the analysis."""
+        if self._http_pool is None or self._ori_proto != 'http' or \
+                self._force_proto:
+            return False
+        feed = httpfeed.HTTPFeed(
+            self._url, self._http_pool.session(self.host), self._timeout)
+        cmd = ['ffprobe'] + list(self.input_options) + \
+            ['pipe:0', '-show_entries', 'format:stream',
+             '-print_format', 'json']
+        tracks = None
+        try:
+            with self._measure('http', proto='http') as event:
+                prefix = feed.prefetch()
+                event['bytes'] = len(prefix)
+                event['live'] = feed.is_live
+                tracks = self._parse_probe_output(subprocess.check_output(
+                    cmd, input=prefix, timeout=self._probe_timeout(0)))
+        except (httpfeed.requests.RequestException,
+                subprocess.CalledProcessError,
+                subprocess.TimeoutExpired, ValueError) as e:
+            self._logger.warning('Failed to probe %s from http feed: %r',
+                                 self._url, e)
+        if not tracks:
+            feed.close()
+            return False
+
+        for track in tracks.values():
+            # ffprobe can not tell size of piped input
+            if not feed.is_live and track['duration'] == NONEXIST and \
+                    track['bit_rate'] > 0:
+                track['duration'] = feed.total_size * 8.0 / \
+                    track['bit_rate']
+        self._feed = feed
+        self._select_protocol({'http': {
+            'proto': 'http',
+            'con_time': feed.con_time,
+            'tracks': tracks,
+            }})
+        return True
+
+    def _race_audio_tracks(self):
+        """Probe all possible protocols in parallel.
+
+        The first protocol that finishes probing with valid tracks
+        and no failed attempt has the lowest con_time, children of
+        other protocols are killed once it finishes. A protocol with
+        failed attempts only ends the race if its con_time is below
+        the time already elapsed, which no other protocol can beat."""
+        race = _ProtocolRace()
+        streams = {}
+        start_time = time.time()
+
+        def probe(proto):
+            try:
+                result = self._probe_protocol(proto, race)
+            except _RaceLost:
+                self._logger.info('Protocol %s lost the race', proto)
+                result = self._protocol_result(
+                    proto, None, [TIME_PUNISHMENT])
             else:
-                url = proto + '://' + self._url_without_proto
-            if proto != 'file' and not tricks.is_ascii(url):
-                url = tricks.url_fix(url)
-            input_options = list(self.input_options)
-            if proto == 'rtsp':
-                input_options = ['-rtsp_transport', 'tcp'] + input_options
-            elif proto == 'rtmp':
-                url = url + ' live=1'
-
-            cmd = ['ffprobe'] + input_options + \
-                [url, '-show_entries', 'format:stream',
-                 '-print_format', 'json']
-            json_data = None
-            probing_time = []
-            for i in range(self._repeat_times):
-                try:
-                    tmp_data = None
-                    te = None
-                    for i in range(self._retry_times):
-                        start_time = time.time()
-                        if self._timeout is not None:
-                            # TODO: timeout adjustment
-                            timeout = self._timeout * (1 + i / 2)
-                            self._logger.info(
-                                'Adjusting timeout to %s', timeout)
-                        else:
-                            timeout = None
-                        try:
-                            tmp_data = subprocess.check_output(
-                                cmd, timeout=timeout)
-                        except Exception as e:
-                            te = e
-                        else:
-                            break
-                    if tmp_data is None and te is not None:
-                        raise te
-                except subprocess.CalledProcessError as e:
-                    self._logger.warning('Called Process Error: %s', e)
-                    probing_time.append(TIME_PUNISHMENT)
-                except subprocess.TimeoutExpired as e:
-                    self._logger.warning('Timeout Expired: %s', e.cmd)
-                    probing_time.append(TIME_PUNISHMENT)
-                else:
-                    json_data = tmp_data
-                    probing_time.append(time.time() - start_time)
-
-            if json_data:
-                data = json.loads(json_data.decode('utf-8', 'ignore'))
-                tracks_for_current_proto = {}
-                for i in data['streams']:
-                    if i.get('codec_type') == 'audio':
-                        track = {}
-                        track['codec'] = i.get('codec_name', '')
-                        track['profile'] = i.get('profile', '')
-                        track['bit_rate'] = int(float(
-                            i.get('bit_rate', NONEXIST)))
-                        track['sample_rate'] = int(
-                            i.get('sample_rate', NONEXIST))
-                        track['channels'] = int(
-                            i.get('channels', NONEXIST))
-                        track['duration'] = float(
-                            i.get('duration',
-                                  data['format'].get('duration', NONEXIST)))
-                        track['format_name'] = data['format'].get(
-                            'format_name', '')
-                        index = int(i['index'])
-                        track['index'] = index
-                        tracks_for_current_proto[index] = track
+                if result['tracks'] is not None and (
+                        not result['failures'] or
+                        result['con_time'] < time.time() - start_time):
+                    race.finish()
+            streams[proto] = result
+
+        threads = [threading.Thread(target=probe, args=(proto,))
+                   for proto in self.possible_protocols]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._select_protocol(streams)
+
+    def _probe_protocol(self, proto, race=None):
+        """Probe url with <proto> for repeat_times to get con_time.
+
+        :param race: a _ProtocolRace if protocols are probed in parallel"""
+        probing = _ProtocolProbing(self, proto)
+        for retry, timeout in probing.attempts():
+            hedge = None
+            if race is None:
+                hedge = self._hedged_check_output(proto)
+                check_output = subprocess.check_output \
+                    if hedge is None else hedge.check_output
+            else:
+                check_output = race.check_output
+            try:
+                with self._measure('ffprobe', proto=proto, retry=retry,
+                                   timeout=timeout) as event:
+                    try:
+                        tier, json_data, start_time = self._run_tiers(
+                            proto, check_output, timeout)
+                        event['tier'] = tier
+                    finally:
+                        if hedge is not None:
+                            event['hedged'] = hedge.hedged
+                    event['output_bytes'] = len(json_data)
+            except _RaceLost:
+                raise
+            except Exception as e:
+                probing.failed(e)
             else:
-                tracks_for_current_proto = None
+                probing.succeeded(json_data, start_time)
+        return probing.result()
+
+    def _run_tiers(self, proto, check_output, timeout):
+        """Run ffprobe of tiers until one is accepted.
+
+        start_time is when ffprobe of the accepted tier was started,
+        so that con_time does not include rejected tiers.
+        Will return a tuple:
+            (tier, json_data, start_time)"""
+        for tier, cmd in self._tier_cmds(proto):
+            start_time = time.time()
+            try:
+                json_data = check_output(cmd, timeout=timeout)
+            except (subprocess.CalledProcessError,
+                    subprocess.TimeoutExpired) as e:
+                self._tier_failed(proto, tier, e)
+                continue
+            if self._accept_tier(proto, tier, json_data):
+                return tier, json_data, start_time
+
+    def _probe_cmd(self, proto, path=None, fast=False):
+        """Get ffprobe command to probe url with <proto>.
+
+        :param path: local file to probe instead of url if proto is file
+        :param fast: only probe audio streams with small probesize"""
+        if proto == 'file' and path is not None:
+            return ['ffprobe', path, '-show_entries', 'format:stream',
+                    '-print_format', 'json']
+        if proto == 'file':
+            url = self._url
+        else:
+            url = proto + '://' + self._url_without_proto
+        if proto != 'file' and not tricks.is_ascii(url):
+            url = tricks.url_fix(url)
+        input_options = list(self.input_options)
+        if proto == 'rtsp':
+            input_options = ['-rtsp_transport', 'tcp'] + input_options
+        elif proto == 'rtmp':
+            url = url + ' live=1'
+        output_options = []
+        if fast:
+            input_options = [
+                '-probesize', str(FAST_PROBESIZE),
+                '-analyzeduration', str(FAST_ANALYZEDURATION),
+                ] + input_options
+            output_options = ['-select_streams', 'a']
+
+        return ['ffprobe'] + input_options + [url] + output_options + \
+            ['-show_entries', 'format:stream', '-print_format', 'json']
+
+    def _tier_cmds(self, proto):
+        """Get ffprobe commands to try one after another.
+
+        Once the fast tier has been escalated for <proto>,
+        its full tier is probed directly.
+
+        Will return a list of tuples:
+            [(tier, cmd)]"""
+        full = ('full', self._probe_cmd(proto))
+        if not self._tiered or self._probe_tiers.get(proto) == 'full':
+            return [full]
+        return [('fast', self._probe_cmd(proto, fast=True)), full]
+
+    def _tier_failed(self, proto, tier, error):
+        """Go on with the full tier after the fast tier failed,
+        raise error if the full tier failed."""
+        if tier != 'fast':
+            raise error
+        self._logger.info('Escalating probing of %s to full: %r',
+                          proto, error)
+        self._probe_tiers[proto] = 'full'
+
+    def _accept_tier(self, proto, tier, json_data):
+        """Check if ffprobe output of <tier> is complete enough.
+
+        Duration is only required of local files, live streams never
+        have one."""
+        if tier == 'fast':
+            fields = TIERED_FIELDS
+            if proto != 'file':
+                fields = tuple(k for k in fields if k != 'duration')
+            tracks = self._parse_probe_output(json_data)
+            if not tracks or any(track[k] == NONEXIST
+                                 for track in tracks.values()
+                                 for k in fields):
+                self._logger.info('Escalating probing of %s to full', proto)
+                return False
+        if self._tiered:
+            self._probe_tiers[proto] = tier
+        return True
+
+    def _probe_timeout(self, retry, proto=None):
+        """Get timeout of the <retry>th try of probing.
+
+        Taken from history of the host if long enough,
+        or from the fixed schedule based on timeout."""
+        if self._timeout is None:
+            return None
+        timeout = None
+        if self._history is not None and proto is not None:
+            timeout = self._history.timeout_for(
+                self._history_key(proto), retry)
+        if timeout is None:
+            timeout = self._timeout * (1 + retry / 2)
+        self._logger.info('Adjusting timeout to %s', timeout)
+        return timeout
+
+    def _history_key(self, proto):
+        return '{}://{}'.format(proto, self.host)
+
+    def _record_history(self, proto, con_time):
+        """Record an attempt of probing, con_time None if failed."""
+        if self._history is not None and self._ori_proto != 'file':
+            self._history.record(self._history_key(proto), con_time)
+
+    def _hedged_check_output(self, proto):
+        """Get a _Hedge of <proto>, None if not hedging."""
+        if not self._hedge or self._history is None:
+            return None
+        delay = self._history.hedge_delay(self._history_key(proto))
+        if delay is None:
+            return None
+        return _Hedge(delay)
+
+    def _protocol_result(self, proto, json_data, probing_time):
+        """Summarize probing of <proto> from ffprobe output and timing."""
+        if json_data:
+            tracks_for_current_proto = self._parse_probe_output(json_data)
+        else:
+            tracks_for_current_proto = None
+
+        avg_conn_time = sum(probing_time) / len(probing_time)
+        self._emit('protocol', proto=proto, con_time=avg_conn_time,
+                   outcome='ok' if tracks_for_current_proto is not None
+                   else 'error')
+        return {
+            'proto': proto,
+            'con_time': avg_conn_time,
+            'tracks': tracks_for_current_proto,
+            'failures': probing_time.count(TIME_PUNISHMENT),
+            }
 
-            avg_conn_time = sum(probing_time) / len(probing_time)
-            streams[proto] = {
-                'proto': proto,
-                'con_time': avg_conn_time,
-                'tracks': tracks_for_current_proto,
-                }
+    def _parse_probe_output(self, json_data):
+        """Parse json output of ffprobe into a dict of audio tracks."""
+        data = json.loads(json_data.decode('utf-8', 'ignore'))
+        tracks = {}
+        for i in data['streams']:
+            if i.get('codec_type') == 'audio':
+                track = {}
+                track['codec'] = i.get('codec_name', '')
+                track['profile'] = i.get('profile', '')
+                track['bit_rate'] = int(float(
+                    i.get('bit_rate', NONEXIST)))
+                track['sample_rate'] = int(
+                    i.get('sample_rate', NONEXIST))
+                track['channels'] = int(
+                    i.get('channels', NONEXIST))
+                track['duration'] = float(
+                    i.get('duration',
+                          data['format'].get('duration', NONEXIST)))
+                track['format_name'] = data['format'].get(
+                    'format_name', '')
+                index = int(i['index'])
+                track['index'] = index
+                tracks[index] = track
+        return tracks
+
+    def _select_protocol(self, streams):
+        """Select protocol with the lowest con_time among valid ones."""
         self._logger.info(pprint.pformat(streams))
         valid_tracks = [i for i in streams.values() if i['tracks'] is not None]
         if valid_tracks:
@@ -513,7 +1679,84 @@ class AudioProber(object):
             self._con_time = info_of_selected_track['con_time']
             self._proto = info_of_selected_track['proto']
             self._tracks = info_of_selected_track['tracks']
+            self._emit('select', proto=self._proto, con_time=self._con_time,
+                       outcome='ok')
+            self.probe_tier = self._probe_tiers.get(self._proto)
+            if self.probe_tier is not None:
+                self._emit('tier', proto=self._proto,
+                           outcome=self.probe_tier)
+            self._store_cached_tracks()
             return self._tracks
+        self._emit('select', outcome='error')
+
+    def _cache_key(self, kind):
+        if kind == 'tracks':
+            return probecache.make_key(self._url, self.input_options,
+                                       self._force_proto)
+        index = self.best_track['index']  # probes protocol if not yet
+        if self._all_tracks:
+            index = 'all'
+        params = [self._proto, index, self._min_len, self._max_len,
+                  self._engine, self._adaptive, self._tolerance]
+        if self._segments:
+            params += [self._segments, self._segment_len]
+        return '{} {}'.format(self._cache_key('tracks'), json.dumps(params))
+
+    def _load_cached_tracks(self):
+        """Load protocol, con_time and tracks from cache if any."""
+        if self._cache is None:
+            return False
+        cached = self._cache.get('tracks', self._cache_key('tracks'))
+        self._emit('cache', kind='tracks',
+                   outcome='miss' if cached is None else 'hit')
+        if cached is None:
+            return False
+        self._proto = cached['proto']
+        self._con_time = cached['con_time']
+        self._tracks = {int(k): v for k, v in cached['tracks'].items()}
+        self.probe_tier = cached.get('tier')
+        return True
+
+    def _store_cached_tracks(self):
+        if self._cache is None:
+            return
+        self._cache.set('tracks', self._cache_key('tracks'), {
+            'proto': self._proto,
+            'con_time': self._con_time,
+            'tracks': self._tracks,
+            'tier': self.probe_tier,
+            })
+
+    def _load_cached_analysis(self):
+        """Load tested_duration, volume and loudness from cache if any."""
+        if self._cache is None:
+            return False
+        cached = self._cache.get('analysis', self._cache_key('analysis'))
+        self._emit('cache', kind='analysis',
+                   outcome='miss' if cached is None else 'hit')
+        if cached is None:
+            return False
+        self._tested_duration = cached['tested_duration']
+        self.analysis_confidence = cached.get('analysis_confidence')
+        self._volume = {int(k): v for k, v in cached['volume'].items()}
+        self._loudness = {int(k): v for k, v in cached['loudness'].items()}
+        if cached.get('track_analysis') is not None:
+            self.track_analysis = decode_track_analysis(
+                cached['track_analysis'])
+            self._best_track_index = cached['best_track_index']
+        return True
+
+    def _store_cached_analysis(self):
+        if self._cache is None:
+            return
+        self._cache.set('analysis', self._cache_key('analysis'), {
+            'tested_duration': self._tested_duration,
+            'analysis_confidence': self.analysis_confidence,
+            'volume': self._volume,
+            'loudness': self._loudness,
+            'track_analysis': self.track_analysis,
+            'best_track_index': self._best_track_index,
+            })
 
     def _get_best_track(self):
         """Get best track.
@@ -524,9 +1767,17 @@ class AudioProber(object):
         if not self.tracks:
             return
 
+        candidates = list(self.tracks.values())
+        if self.track_analysis is not None:
+            healthy = [track for track in candidates
+                       if self.track_analysis[track['index']]
+                       ['health']['healthy']]
+            if healthy:  # if no track is healthy, select among all
+                candidates = healthy
+
         # Calculate longest duration
         max_duration = -1
-        for index, track in self.tracks.items():
+        for track in candidates:
             if track['duration'] > max_duration:
                 max_duration = track['duration']
 
@@ -540,21 +1791,97 @@ class AudioProber(object):
                 track['codec'], WEIGHT_OF_CODEC['default'])
             return float(bit_rate * weight_by_bit_rate)
 
-        best_track = max(self.tracks.values(), key=lambda x: value(x))
+        best_track = max(candidates, key=lambda x: value(x))
 
         self._best_track_index = best_track['index']
         return best_track
 
 
+def protocols_of(proto, force_proto=False):
+    """Protocols to probe for scheme <proto> of url, empty if unsupported.
+
+    :param proto: scheme of url, file for local files
+    :param force_proto: use scheme as the only protocol"""
+    proto = proto.replace('rtspt', 'rtsp').replace('rtmpt', 'rtmp')
+    if force_proto:
+        return [proto]
+    elif proto == 'file':
+        return ['file']
+    elif proto == 'rtmp':
+        return ['rtmp']
+    elif proto == 'http':
+        return ['http', 'mmsh']
+    elif proto in ['mms', 'mmsh', 'mmst', 'rtsp']:
+        return ['rtsp', 'mmsh']
+    return []
+
+
 def probe_and_select_from_stream(url, **kwargs):
-    ap = AudioProber(url, **kwargs)
-    ap._get_volume_and_loudness()
+    with AudioProber(url, **kwargs) as ap:
+        ap._get_volume_and_loudness()
+        return result_of_prober(ap)
+
+
+def aggregate_windows(windows):
+    """Aggregate volume and loudness of analyzed windows.
+
+    Mean volume is averaged in power weighted by seconds,
+    max volume is the max of windows, loudness is averaged in power
+    over windows passing the absolute and relative gates,
+    like blocks of integrated loudness.
+
+    :param windows: a list of tuples (seconds, volume, loudness)
+    Will return a tuple:
+        (volume, loudness)"""
+    def power_mean(pairs):
+        total = sum(seconds for seconds, _ in pairs)
+        return 10 * math.log10(
+            sum(seconds * 10 ** (db / 10.0) for seconds, db in pairs) /
+            total)
+
+    volume = {}
+    for channel in windows[0][1]:
+        volume[channel] = {
+            'volume_mean': round(power_mean(
+                [(seconds, v[channel]['volume_mean'])
+                 for seconds, v, _ in windows]), 1),
+            'volume_max': max(v[channel]['volume_max']
+                              for _, v, _ in windows),
+            }
+    loudness = {}
+    for channel in windows[0][2]:
+        pairs = [(seconds, l[channel]) for seconds, _, l in windows
+                 if l[channel] > ABSOLUTE_GATE]
+        if not pairs:
+            loudness[channel] = ABSOLUTE_GATE
+            continue
+        gate = power_mean(pairs) + RELATIVE_GATE
+        loudness[channel] = round(
+            power_mean([(seconds, db) for seconds, db in pairs
+                        if db >= gate]), 1)
+    return volume, loudness
+
+
+def decode_track_analysis(track_analysis):
+    """Restore int track and channel keys of track_analysis lost in json."""
+    return dict((int(index), dict(
+        data,
+        volume=dict((int(k), v) for k, v in data['volume'].items()),
+        loudness=dict((int(k), v) for k, v in data['loudness'].items())))
+        for index, data in track_analysis.items())
+
+
+def result_of_prober(ap):
+    """Collect result dict of a prober whose analysis is done."""
     result = dict(ap.best_track)
     result['input_options'] = ap.input_options
     result['output_options'] = ap.output_options
     result['best_url'] = ap.best_url
     result['tested_duration'] = ap._tested_duration
+    result['analysis_confidence'] = ap.analysis_confidence
+    result['track_analysis'] = ap.track_analysis
     result['con_time'] = ap._con_time
+    result['probe_tier'] = ap.probe_tier
     result['selected_protocol'] = ap._proto
     result['volume'] = ap.volume
     result['loudness'] = ap.loudness
@@ -571,11 +1898,120 @@ def probe_and_select_from_stream(url, **kwargs):
     return result
 
 
+def read_urls(fileobj):
+    """Yield urls of a list, one per line, skipping blanks and comments."""
+    for line in fileobj:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def probe_batch(urls, probe, jobs=4, per_host=2, writer=None,
+                connections_of=None):
+    """Probe urls concurrently, writing results as they finish.
+
+    urls are read in a thread, so results are written while urls are
+    still coming, e.g. from a pipe; at most BATCH_PENDING_FACTOR * jobs
+    urls are submitted and not finished at the same time.
+
+    :param urls: iterable of urls
+    :param probe: called with a url to get its result dict
+    :param jobs: max number of urls probed at the same time
+    :param per_host: max number of connections to one host at the same
+        time, see scheduler.HostScheduler
+    :param writer: a proberesult.JSONLinesWriter
+    :param connections_of: called with a url to get the number of
+        connections its probe opens, 1 if None
+    Will return a dict of counters:
+        {'total': ..., 'ok': ..., 'failed': ..., 'timeouts': ...,
+         'elapsed': ...}"""
+    from aucommon import proberesult
+    from aucommon import scheduler
+
+    logger = logging.getLogger(__name__)
+    summary = {'total': 0, 'ok': 0, 'failed': 0, 'timeouts': 0}
+    start_time = time.time()
+    host_scheduler = scheduler.HostScheduler(jobs, per_host)
+    finished = queue.Queue()  # (url, future), None once urls are read
+    slots = threading.Semaphore(BATCH_PENDING_FACTOR * jobs)
+    submitted = [0]
+    read_errors = []
+
+    def submit_all():
+        try:
+            for url in urls:
+                slots.acquire()
+                connections = 1
+                if connections_of is not None:
+                    connections = connections_of(url)
+                future = host_scheduler.submit_weighted(
+                    AudioProber.host_of(url), connections, probe, url)
+                submitted[0] += 1
+                future.add_done_callback(
+                    lambda future, url=url: finished.put((url, future)))
+        except Exception as e:
+            read_errors.append(e)
+        finally:
+            finished.put(None)
+
+    reader = threading.Thread(target=submit_all)
+    reader.daemon = True
+    reader.start()
+    try:
+        all_read = False
+        while not all_read or summary['total'] < submitted[0]:
+            item = finished.get()
+            if item is None:
+                all_read = True
+                continue
+            url, future = item
+            slots.release()
+            summary['total'] += 1
+            error = future.exception()
+            if error is None:
+                summary['ok'] += 1
+                logger.info('%s\n%s', url, pprint.pformat(future.result()))
+                row = proberesult.ProbeResult.from_dict(
+                    future.result(), url).to_row()
+                row['outcome'] = 'ok'
+            else:
+                summary['failed'] += 1
+                outcome = 'error'
+                if isinstance(error, subprocess.TimeoutExpired):
+                    summary['timeouts'] += 1
+                    outcome = 'timeout'
+                logger.warning('Failed to probe %s: %r', url, error)
+                row = {'url': url, 'outcome': outcome, 'error': repr(error)}
+            if writer is not None:
+                writer.write_row(row)
+    finally:
+        host_scheduler.shutdown(wait=False)
+    if read_errors:
+        raise read_errors[0]
+    summary['elapsed'] = time.time() - start_time
+    return summary
+
+
 def main():
+    if sys.argv[1:2] == ['serve']:  # auprobe serve: run probe daemon
+        from aucommon import probed
+        return probed.main(sys.argv[2:])
+    if sys.argv[1:2] == ['monitor']:  # auprobe monitor: watch live stream
+        from aucommon import monitor
+        return monitor.main(sys.argv[2:])
+
     # set up argparse
     parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('url', help='local file / url to probe')
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog='Run "auprobe serve -h" for the probe daemon, '
+        '"auprobe monitor -h" to monitor live streams.')
+    parser.add_argument('url', nargs='*', help='local files / urls to probe')
+    parser.add_argument('-l', '--url_list', default=None,
+                        help='file of urls, one per line, - for stdin')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='max number of urls probed at the same time')
+    parser.add_argument('--per_host', type=int, default=2,
+                        help='max connections to one host at the same time')
     parser.add_argument('-i', '--input_options',
                         type=lambda x: shlex.split(x),
                         default=[], help='prober')
@@ -587,7 +2023,41 @@ def main():
                         default=3, help='retry times for probing protocol')
     parser.add_argument('--force_proto', action='store_true',
                         help='use scheme in url as proto')
+    parser.add_argument('--race_protocols', action='store_true',
+                        help='probe possible protocols in parallel')
+    parser.add_argument('--spool', action='store_true',
+                        help='capture best track once and analyze locally')
+    parser.add_argument('--spool_dir', default=None,
+                        help='keep captures of --spool here and reuse '
+                        'them, with --server the one of the daemon')
+    parser.add_argument('--engine', choices=ENGINES, default='ffmpeg',
+                        help='engine to analyze volume and loudness')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='stop analysis once estimates converge')
+    parser.add_argument('--cache', default=None,
+                        help='path of SQLite cache of probing results')
+    parser.add_argument('--history', default=None,
+                        help='path of per-host history of connection times')
+    parser.add_argument('--segments', type=int, default=0,
+                        help='analyze N windows of long local files')
+    parser.add_argument('--all_tracks', action='store_true',
+                        help='analyze all audio tracks, prefer healthy ones')
+    parser.add_argument('--pool_http', action='store_true',
+                        help='fetch http urls once and pipe them to ffmpeg')
+    parser.add_argument('--parse_headers', action='store_true',
+                        help='parse common local files without ffprobe')
+    parser.add_argument('--scan_headers', action='store_true',
+                        help='walk all frames for exact duration, '
+                        'with --parse_headers')
+    parser.add_argument('--tiered', action='store_true',
+                        help='probe with small probesize first')
+    parser.add_argument('--hedge', action='store_true',
+                        help='hedge ffprobe slower than p95 of the host')
+    parser.add_argument('--server', default=None,
+                        help='probe with daemon at unix:/path or host:port')
     args = parser.parse_args()
+    if not args.url and args.url_list is None:
+        parser.error('no url given, pass urls or --url_list')
 
     # set up logging
     config_log.config_log('/tmp', 'auprober.log', 'DEBUG')
@@ -595,15 +2065,78 @@ def main():
     logger.info('-' * 40 + '<%s>' + '-' * 40, time.asctime())
     logger.info('Arguments: %s', args)
 
-    logger.info('\n' + pprint.pformat(
-        probe_and_select_from_stream(
-            args.url,
-            input_options=args.input_options,
-            repeat_times=args.repeat_times,
-            timeout=args.timeout,
-            retry_times=args.retry_times,
-            force_proto=args.force_proto)))
+    options = {
+        'input_options': args.input_options,
+        'repeat_times': args.repeat_times,
+        'timeout': args.timeout,
+        'retry_times': args.retry_times,
+        'force_proto': args.force_proto,
+        'race_protocols': args.race_protocols,
+        'spool': args.spool or args.spool_dir is not None,
+        'engine': args.engine,
+        'adaptive': args.adaptive,
+        'hedge': args.hedge,
+        'tiered': args.tiered,
+        'parse_headers': args.parse_headers,
+        'scan_headers': args.scan_headers,
+        'all_tracks': args.all_tracks,
+        'segments': args.segments,
+        }
+    history = None
+    if args.server:
+        from aucommon import probed
+        client = probed.ProbeClient(args.server)
+
+        def probe(url):
+            return client.probe(url, **options)
+    else:
+        cache = None
+        if args.cache:
+            cache = probecache.ProbeCache(args.cache)
+        if args.history:
+            history = hoststats.HostHistory(args.history)
+        http_pool = None
+        if args.pool_http:
+            http_pool = httpfeed.SessionPool()
+
+        def probe(url):
+            return probe_and_select_from_stream(
+                url, cache=cache, history=history,
+                http_pool=http_pool, spool_dir=args.spool_dir, **options)
+
+    urls = iter(args.url)
+    url_list = None
+    if args.url_list == '-':
+        url_list = sys.stdin
+    elif args.url_list is not None:
+        url_list = open(args.url_list)
+    if url_list is not None:
+        urls = itertools.chain(urls, read_urls(url_list))
+
+    from aucommon import proberesult
+    try:
+        with proberesult.JSONLinesWriter(sys.stdout) as writer:
+            summary = probe_batch(
+                urls, probe, args.jobs, args.per_host, writer,
+                lambda url: AudioProber.connections_of(url, **options))
+    finally:
+        if url_list is not None and url_list is not sys.stdin:
+            url_list.close()
+        if history is not None:
+            history.save()
+
+    logger.info('Summary: %s', summary)
+    sys.stderr.write(
+        '{total} urls in {elapsed:.1f}s ({rate:.2f} urls/s), ok: {ok}, '
+        'failed: {failed}, timeouts: {timeouts}\n'.format(
+            rate=summary['total'] / max(summary['elapsed'], 1e-6),
+            **summary))
+    if summary['failed'] and summary['failed'] == summary['total']:
+        return EXIT_ALL_FAILED
+    if summary['failed']:
+        return EXIT_SOME_FAILED
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#! /usr/bin/env python3
+"""
+Benchmark and Regression Check of AudioProber with Local Synthetic Streams
+
+Fixtures are generated with ffmpeg lavfi sources in several codecs and
+containers, and optionally served by a local HTTP server.
+Every AudioProber stage is timed and the abnormality flags are checked
+against what each fixture is made to be.
+
+RTSP / RTMP are not covered, they need an external media server.
+"""
+
+import argparse
+import functools
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from cocommon.utils.compat import subprocess
+
+from aucommon import auprobe
+
+
+TONE = 'sin(2*PI*440*t)'
+FLAGS = ('inverted', 'll', 'rr', 'too_loud', 'too_low')
+
+# name: (aevalsrc expressions of channels, channel_layout, flags expected)
+FIXTURES = {
+    'mono': (['0.25*' + TONE], 'mono', ()),
+    'stereo': (['0.25*' + TONE, '0.25*' + TONE], 'stereo', ()),
+    'inverted': (['0.25*' + TONE, '-0.25*' + TONE], 'stereo',
+                 ('inverted',)),
+    'right_silent': (['0.25*' + TONE, '0'], 'stereo', ('ll',)),
+    'left_silent': (['0', '0.25*' + TONE], 'stereo', ('rr',)),
+    'clipping': (['clip(2*{},-1,1)'.format(TONE)] * 2, 'stereo',
+                 ('too_loud',)),
+    'quiet': (['0.005*' + TONE] * 2, 'stereo', ('too_low',)),
+    '5.1': (['0.25*' + TONE] * 6, '5.1', ()),
+    }
+
+# name: (encoder, container, extension, max channels)
+CODECS = {
+    'aac': ('aac', 'adts', '.aac', 6),
+    'mp3': ('libmp3lame', 'mp3', '.mp3', 2),
+    'flac': ('flac', 'flac', '.flac', 6),
+    'vorbis': ('libvorbis', 'ogg', '.ogg', 6),
+    'wav': ('pcm_s16le', 'wav', '.wav', 6),
+    }
+
+
+def generate_fixtures(directory, duration=12, codecs=None, logger=None):
+    """Generate fixtures into directory, skip existing ones.
+
+    Will return a list of tuples:
+        (path, fixture_name, codec_name)"""
+    fixtures = []
+    for fixture_name, (exprs, layout, _) in sorted(FIXTURES.items()):
+        for codec_name in codecs or sorted(CODECS):
+            encoder, container, ext, max_channels = CODECS[codec_name]
+            if len(exprs) > max_channels:
+                continue
+            path = os.path.join(
+                directory, '{}_{}{}'.format(fixture_name, codec_name, ext))
+            if not os.path.isfile(path):
+                src = 'aevalsrc={}:s=44100:c={}:d={}'.format(
+                    '|'.join(exprs), layout, duration)
+                cmd = ['ffmpeg', '-nostats', '-loglevel', 'error', '-y',
+                       '-f', 'lavfi', '-i', src,
+                       '-c:a', encoder, '-f', container, path]
+                try:
+                    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+                except subprocess.CalledProcessError as e:
+                    if logger is not None:
+                        logger('Skipping {}: {}'.format(
+                            path, e.output.decode('utf-8', 'ignore')))
+                    continue
+            fixtures.append((path, fixture_name, codec_name))
+    return fixtures
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_http(directory):
+    """Serve directory on a random local port in a daemon thread.
+
+    Will return the server, stop it with server.shutdown()."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+def probe_stages(url, **kwargs):
+    """Probe url with AudioProber, timing every stage.
+
+    Will return a tuple:
+        (timings, abnormals)"""
+    timings = {}
+    start_time = time.time()
+    with auprobe.AudioProber(url, **kwargs) as ap:
+        ap._get_audio_tracks()
+        timings['protocol'] = time.time() - start_time
+
+        t = time.time()
+        if ap._get_best_track() is None:
+            raise auprobe.InvalidURL(url)
+        timings['track'] = time.time() - t
+
+        t = time.time()
+        ap._get_volume_and_loudness()
+        timings['analysis'] = time.time() - t
+        timings['total'] = time.time() - start_time
+
+        abnormals = dict((flag, getattr(ap, 'is_' + flag)) for flag in FLAGS)
+    return timings, abnormals
+
+
+def run(jobs, concurrency=1, **kwargs):
+    """Probe all jobs and check their abnormality flags.
+
+    :param jobs: a list of (url, fixture_name, codec_name)
+    :param concurrency: number of urls probed at the same time
+    :param kwargs: arguments passed to AudioProber
+    Will return a report dict."""
+    records = []
+    lock = threading.Lock()
+    pending = list(jobs)
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                url, fixture_name, codec_name = pending.pop(0)
+            record = {'url': url, 'fixture': fixture_name,
+                      'codec': codec_name}
+            try:
+                record['timings'], abnormals = probe_stages(url, **kwargs)
+            except Exception as e:
+                record['error'] = repr(e)
+            else:
+                expected = FIXTURES[fixture_name][2]
+                record['mismatches'] = [
+                    flag for flag in FLAGS
+                    if abnormals[flag] != (flag in expected)]
+            with lock:
+                records.append(record)
+
+    start_time = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start_time
+
+    stages = {}
+    for stage in ('protocol', 'track', 'analysis', 'total'):
+        values = [r['timings'][stage] for r in records if 'timings' in r]
+        stages[stage] = {
+            'count': len(values),
+            'mean': sum(values) / len(values) if values else None,
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+            }
+    return {
+        'urls': len(records),
+        'wall_time': wall_time,
+        'throughput': len(records) / wall_time if wall_time else None,
+        'stages': stages,
+        'errors': [r for r in records if 'error' in r],
+        'mismatches': [r for r in records if r.get('mismatches')],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--directory', default=None,
+                        help='directory of fixtures, a tempdir if not set')
+    parser.add_argument('--duration', type=int, default=12,
+                        help='duration of fixtures in seconds')
+    parser.add_argument('--codecs', nargs='+', choices=sorted(CODECS),
+                        default=None, help='codecs of fixtures')
+    parser.add_argument('--http', action='store_true',
+                        help='probe fixtures through a local http server')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of urls probed at the same time')
+    parser.add_argument('--engine', choices=auprobe.ENGINES,
+                        default='ffmpeg',
+                        help='engine to analyze volume and loudness')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='stop analysis once estimates converge')
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix='aubench_')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def log(msg):
+        sys.stderr.write(msg + '\n')
+
+    fixtures = generate_fixtures(
+        directory, args.duration, args.codecs, logger=log)
+    log('{} fixtures in {}'.format(len(fixtures), directory))
+
+    kwargs = {'engine': args.engine, 'adaptive': args.adaptive}
+    server = None
+    if args.http:
+        server = serve_http(directory)
+        base = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        fixtures = [(base + os.path.basename(path), fixture_name, codec_name)
+                    for path, fixture_name, codec_name in fixtures]
+        kwargs['force_proto'] = True
+    try:
+        report = run(fixtures, args.jobs, **kwargs)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if report['errors'] or report['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
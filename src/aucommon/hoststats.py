@@ -0,0 +1,116 @@
+"""
+Persisted Per-Host History of Connection Times
+
+Drives adaptive timeouts and hedged attempts of AudioProber.
+"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+MIN_SAMPLES = 5  # below this the fixed timeout schedule is used
+MAX_SAMPLES = 100  # connection times kept per host for percentiles
+EWMA_ALPHA = 0.2
+TIMEOUT_FACTOR = 2  # timeout is p95 times this, divided by success rate
+MIN_TIMEOUT = 2
+MAX_TIMEOUT = 120
+SAVE_INTERVAL = 60
+
+
+class HostHistory(object):
+
+    """EWMA, percentiles and success rate of connection times by key.
+
+    Keys are usually proto://host, as protocols of the same host
+    can behave very differently."""
+
+    def __init__(self, path=None, save_interval=SAVE_INTERVAL):
+        """History.
+
+        :param path: json file to load from and save to, None to keep
+            history in memory only
+        :param save_interval: min seconds between automatic saves"""
+        self._path = path
+        self._save_interval = save_interval
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._last_save = time.time()
+        if path is not None and os.path.isfile(path):
+            with open(path) as f:
+                self._hosts = json.load(f)
+
+    def record(self, key, con_time=None):
+        """Record an attempt, con_time None for a failed one."""
+        with self._lock:
+            host = self._hosts.setdefault(key, {
+                'ewma': None, 'samples': [], 'ok': 0, 'failed': 0,
+                })
+            if con_time is None:
+                host['failed'] += 1
+            else:
+                host['ok'] += 1
+                if host['ewma'] is None:
+                    host['ewma'] = con_time
+                else:
+                    host['ewma'] += EWMA_ALPHA * (con_time - host['ewma'])
+                host['samples'].append(con_time)
+                del host['samples'][:-MAX_SAMPLES]
+            need_save = self._path is not None and \
+                time.time() - self._last_save > self._save_interval
+        if need_save:
+            self.save()
+
+    def stats(self, key):
+        """Get a dict of ewma, p50, p95 and success_rate, None if unknown."""
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None or not host['samples']:
+                return None
+            samples = sorted(host['samples'])
+            return {
+                'ewma': host['ewma'],
+                'p50': _percentile(samples, 50),
+                'p95': _percentile(samples, 95),
+                'samples': len(samples),
+                'success_rate': host['ok'] / float(
+                    host['ok'] + host['failed']),
+                }
+
+    def timeout_for(self, key, retry=0):
+        """Timeout of the <retry>th try, None if history is too short."""
+        stats = self.stats(key)
+        if stats is None or stats['samples'] < MIN_SAMPLES:
+            return None
+        timeout = stats['p95'] * TIMEOUT_FACTOR / \
+            max(stats['success_rate'], 0.5)
+        timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, timeout))
+        return timeout * (1 + retry / 2.0)
+
+    def hedge_delay(self, key):
+        """Seconds after which to start a hedged attempt, None if unknown."""
+        stats = self.stats(key)
+        if stats is None or stats['samples'] < MIN_SAMPLES:
+            return None
+        return stats['p95']
+
+    def save(self):
+        """Write history atomically to path."""
+        if self._path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._hosts)
+            self._last_save = time.time()
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self._path)))
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, self._path)
+
+
+def _percentile(samples, p):
+    """Nearest-rank percentile of sorted samples."""
+    rank = int(math.ceil(p / 100.0 * len(samples))) - 1
+    return samples[max(0, min(len(samples) - 1, rank))]
@@ -0,0 +1,163 @@
+"""
+Pooled HTTP Connections Feeding ffprobe and ffmpeg through stdin
+
+One keep-alive connection per url serves both probing and analysis:
+the first bytes are fetched with a range request for static files,
+or read from the open response of Icecast / SHOUTcast streams,
+piped to ffprobe, and then the rest of the same input is piped to ffmpeg.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PREFETCH_SIZE = 256 * 1024  # bytes fetched for probing
+PREFETCH_TIME = 2.0  # max seconds live streams are read for probing
+PREFETCH_CHUNK_SIZE = 4096  # small reads to stop prefetch in time
+CHUNK_SIZE = 64 * 1024
+POOL_SIZE = 4  # keep-alive connections per host
+
+
+class SessionPool(object):
+
+    """Keep-alive requests.Session per host, shared by threads."""
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self._pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return session
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class HTTPFeed(object):
+
+    """Input of a url fetched once and piped to children.
+
+    Call prefetch() first to get the bytes to probe, then pump()
+    the whole input (prefetched bytes included) into stdin of ffmpeg.
+    Input can only be pumped once."""
+
+    def __init__(self, url, session, timeout=None,
+                 prefetch_size=PREFETCH_SIZE, prefetch_time=PREFETCH_TIME):
+        self._url = url
+        self._session = session
+        self._timeout = timeout
+        self._prefetch_size = prefetch_size
+        self._prefetch_time = prefetch_time
+        self._response = None  # response of a live stream, still open
+        self.prefix = None
+        self.total_size = None  # size of static files, None if live
+        self.con_time = None  # seconds until headers of response
+        self._logger = logging.getLogger(__name__)
+
+    @property
+    def is_live(self):
+        return self.prefix is not None and self.total_size is None
+
+    def prefetch(self):
+        """Fetch the first bytes of url.
+
+        Static files are fetched with a range request, so that the
+        connection goes back to the pool, live streams are read up
+        to prefetch_size or for prefetch_time seconds, whichever comes
+        first, and the response is kept open for pump().
+        Will return the bytes fetched."""
+        start_time = time.time()
+        response = self._session.get(
+            self._url, stream=True, timeout=self._timeout,
+            headers={'Range': 'bytes=0-{}'.format(self._prefetch_size - 1)})
+        self.con_time = time.time() - start_time
+        response.raise_for_status()
+        if response.status_code == 206:
+            self.prefix = response.content
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            self.total_size = int(total) if total.isdigit() \
+                else len(self.prefix)
+            return self.prefix
+
+        # range not supported, most likely a live stream
+        deadline = time.time() + self._prefetch_time
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(PREFETCH_CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self._prefetch_size or time.time() >= deadline:
+                self._response = response
+                break
+        else:  # whole body already read
+            self.total_size = size
+            response.close()
+        self.prefix = b''.join(chunks)
+        return self.prefix
+
+    def iter_data(self):
+        """Yield the whole input from the first byte."""
+        yield self.prefix
+        if self._response is not None:
+            response, self._response = self._response, None
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    yield chunk
+            finally:
+                response.close()
+        elif self.total_size is not None and \
+                len(self.prefix) < self.total_size:
+            response = self._session.get(
+                self._url, stream=True, timeout=self._timeout,
+                headers={'Range': 'bytes={}-'.format(len(self.prefix))})
+            try:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    yield chunk
+            finally:
+                response.close()
+
+    def pump(self, stdin):
+        """Write input into stdin of a child in a thread until it exits.
+
+        Will return the thread."""
+        def run():
+            try:
+                for chunk in self.iter_data():
+                    stdin.write(chunk)
+            except (IOError, OSError):  # child exited
+                pass
+            except requests.RequestException as e:
+                self._logger.warning('Failed to feed %s: %r', self._url, e)
+            finally:
+                try:
+                    stdin.close()
+                except (IOError, OSError):
+                    pass
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
@@ -2,43 +2,104 @@
 A Simple TextOnly ID3Tag (v2.4.0) Generator
 """
 
-import struct
-import functools
+import collections
+import errno
+import io
+import logging
 import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import hexdump
 
+from aucommon import audioheaders
+
 major_version = 4
 minor_version = 0
 encoding_dict = {'iso-8859-1': 0, 'utf-16': 1, 'utf-16be': 2, 'utf-8': 3}
+DROP_FIRST_N_FRAMES = 2  # tag is inserted after the first frames
+SEGMENT_EXTENSIONS = ('.aac', '.adts')  # files tagged in a directory
+STREAM_CHUNK_SIZE = 65536  # bytes read at a time by ADTSTagReader
+CHUNK_SIZE = 1024 * 1024  # bytes read at a time when not copied in kernel
+TAG_HEADER = struct.Struct('>3sbbbi')  # 'ID3', versions, flag, size
+FRAME_HEADER = struct.Struct('>ihb')  # size, flag, encoding of payload
+
+
+def _readonly(view):
+    # memoryview.toreadonly is new in python 3.8
+    return view.toreadonly() if hasattr(view, 'toreadonly') else view
 
 
 class ID3Tag(object):
-    """ID3Tag Generator."""
+    """ID3Tag Generator.
+
+    The tag is serialized once into a preallocated buffer and kept
+    until the flag, the frames or any of their fields change."""
 
     def __init__(self, flag=0x00):
         self._flag = flag
         self._frames = []
+        self._buffer = None  # serialized tag
+        self._encoded = []  # frames serialized into buffer
+        self._tag = None  # bytes of buffer
 
     def __str__(self):
         return hexdump.hexdump(self.tag, 'return')
 
+    @property
+    def flag(self):
+        return self._flag
+
+    @flag.setter
+    def flag(self, flag):
+        self._flag = flag
+        self._buffer = None
+
+    def _serialize(self):
+        """Serialize into buffer unless no frame changed since last time.
+
+        Will return the buffer."""
+        encoded = [frame.frame for frame in self._frames]
+        if self._buffer is not None and len(encoded) == len(self._encoded) \
+                and all(x is y for x, y in zip(encoded, self._encoded)):
+            return self._buffer
+
+        size = sum(map(len, encoded))
+        buf = bytearray(TAG_HEADER.size + size)
+        TAG_HEADER.pack_into(buf, 0, b'ID3', major_version, minor_version,
+                             self._flag, size)
+        offset = TAG_HEADER.size
+        for frame in encoded:
+            buf[offset:offset + len(frame)] = frame
+            offset += len(frame)
+        self._buffer = buf
+        self._encoded = encoded
+        self._tag = None
+        return buf
+
     @property
     def size(self):
-        return sum(map(lambda x: len(x.frame), self._frames))
+        return len(self._serialize()) - TAG_HEADER.size
 
     @property
     def header(self):
-        return b'ID3' + \
-            struct.pack('>b', major_version) + \
-            struct.pack('>b', minor_version) + \
-            struct.pack('>b', self._flag) + \
-            struct.pack('>i', self.size)
+        return bytes(self._serialize()[:TAG_HEADER.size])
+
+    @property
+    def view(self):
+        """Read-only memoryview of the serialized tag, without copying.
+
+        Valid until the tag changes."""
+        return _readonly(memoryview(self._serialize()))
 
     @property
     def tag(self):
-        return self.header + functools.reduce(
-            lambda x, y: x + y, map(lambda z: z.frame, self._frames), b'')
+        buf = self._serialize()
+        if self._tag is None:
+            self._tag = bytes(buf)
+        return self._tag
 
     def add_frame(self, frame_id, desc, value, encoding='utf-8', flag=0x0000):
         """Add a new ID3Frame to this ID3Tag.
@@ -53,9 +114,9 @@ class ID3Tag(object):
     def write(self, fn):
         """Write to a binary file only containing ID3Tag."""
         with open(fn, 'wb') as f:
-            f.write(self.tag)
+            f.write(self.view)
 
-    def add_to_adts_file(self, fn, new_fn=None):
+    def add_to_adts_file(self, fn, new_fn=None, in_place=False):
         """Add ID3v2 tag to ADTS file.
 
         Note that ADTS files actually do not support metadata,
@@ -63,11 +124,29 @@ class ID3Tag(object):
 
         Note that this function manipulates binary directly,
         file already containing tags should not be provided as input."""
-        add_id3tag_to_adts(fn, tag=self.tag, output_adts_file=new_fn)
+        add_id3tag_to_adts(fn, tag=self.view, output_adts_file=new_fn,
+                           in_place=in_place)
+
+
+def _frame_field(name):
+    """Property of a field of ID3Frame, dropping the serialized frame
+    when set."""
+    attr = '_' + name
+
+    def fget(self):
+        return getattr(self, attr)
+
+    def fset(self, value):
+        setattr(self, attr, value)
+        self._frame = None
+
+    return property(fget, fset)
 
 
 class ID3Frame(object):
-    """An ID3v2 Frame."""
+    """An ID3v2 Frame.
+
+    The frame is serialized once and kept until any field changes."""
 
     def __init__(self, frame_id, desc, value,
                  encoding='utf-8', flag=0x0000):
@@ -76,58 +155,551 @@ class ID3Frame(object):
         self._value = value
         self._encoding = encoding
         self._flag = flag
+        self._frame = None
+
+    frame_id = _frame_field('frame_id')
+    desc = _frame_field('desc')
+    value = _frame_field('value')
+    encoding = _frame_field('encoding')
+    flag = _frame_field('flag')
 
     def __str__(self):
-        return hexdump.hexdump(self.body, 'return')
+        return hexdump.hexdump(self.frame, 'return')
 
     @property
     def header(self):
-        return self._frame_id.encode('utf-8') + \
-            struct.pack('>i', len(self.payload)) + \
-            struct.pack('>h', self._flag)
+        frame = self.frame
+        return frame[:self._payload_offset]
 
     @property
     def payload(self):
-        return struct.pack('>b', encoding_dict[self._encoding]) + \
-            '{desc}\0{value}\0'.format(
-            desc=self._desc, value=self._value).encode(self._encoding)
+        frame = self.frame
+        return frame[self._payload_offset:]
 
     @property
     def frame(self):
-        return self.header + self.payload
+        if self._frame is None:
+            frame_id = self._frame_id.encode('utf-8')
+            text = '{desc}\0{value}\0'.format(
+                desc=self._desc, value=self._value).encode(self._encoding)
+            # frame id, size and flag are the header, encoding and text
+            # the payload
+            self._payload_offset = len(frame_id) + FRAME_HEADER.size - 1
+            self._frame = b''.join((frame_id, FRAME_HEADER.pack(
+                len(text) + 1, self._flag, encoding_dict[self._encoding]),
+                text))
+        return self._frame
 
 
-def add_id3tag_to_adts(adts_file, output_adts_file=None,
-                       tag=None, tag_file=None):
-    """Add ID3v2 tag to ADTS file.
+class _Field(object):
+    """Variable frame of ID3TagTemplate and where it is in the buffer."""
 
-    Note that ADTS files actually do not support metadata,
-    thus this may produce problematic files.
+    __slots__ = ('desc', 'encoding', 'size_offset', 'text_offset',
+                 'text_length')
+
+    def __init__(self, desc, encoding):
+        self.desc = desc
+        self.encoding = encoding
+        self.size_offset = None  # offset of frame size
+        self.text_offset = None  # offset of '{desc}\0{value}\0'
+        self.text_length = None
 
-    Note that this function manipulates binary directly,
-    file already containing tags should not be provided as input."""
-    DROP_FIRST_N_FRAMES = 2
-    with open(adts_file, 'rb') as f:
-        origin = f.read()
 
+class ID3TagTemplate(object):
+    """ID3Tag of fixed frames and variable fields, serialized once.
+
+    Rendering patches encoded values of fields into the serialized tag
+    in place, sizes of the frame and of the tag are recomputed only if
+    length of a value changes. Rendering is thread safe."""
+
+    def __init__(self, flag=0x00):
+        self._tag = ID3Tag(flag)
+        self._fields = collections.OrderedDict()  # _Field by name
+        self._field_frames = {}  # name by index of frame in tag
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    def add_frame(self, frame_id, desc, value, encoding='utf-8',
+                  flag=0x0000):
+        """Add a fixed frame, see ID3Tag.add_frame."""
+        with self._lock:
+            self._tag.add_frame(frame_id, desc, value, encoding, flag)
+            self._buffer = None
+
+    def add_field(self, name, frame_id, desc, value='', encoding='utf-8',
+                  flag=0x0000):
+        """Add a frame whose value is given by render(name=value).
+
+        :param name: name of field
+        :param value: value until rendered with another value
+        Other params are those of ID3Tag.add_frame."""
+        with self._lock:
+            if name in self._fields:
+                raise ValueError('Duplicate field {}'.format(name))
+            self._field_frames[len(self._tag._frames)] = name
+            self._fields[name] = _Field(desc, encoding)
+            self._tag.add_frame(frame_id, desc, value, encoding, flag)
+            self._buffer = None
+
+    def _compile(self):
+        if self._buffer is not None:
+            return self._buffer
+        self._buffer = bytearray(self._tag.view)
+        offset = TAG_HEADER.size
+        for i, frame in enumerate(self._tag._frames):
+            encoded = frame.frame
+            if i in self._field_frames:
+                field = self._fields[self._field_frames[i]]
+                field.size_offset = offset + len(frame.frame_id.encode(
+                    'utf-8'))
+                field.text_offset = field.size_offset + \
+                    FRAME_HEADER.size
+                field.text_length = len(encoded) - (
+                    field.text_offset - offset)
+            offset += len(encoded)
+        return self._buffer
+
+    def render(self, **values):
+        """Get the tag with values of fields, other fields keep their
+        last values.
+
+        Will return bytes of the tag."""
+        unknown = set(values) - set(self._fields)
+        if unknown:
+            raise ValueError('Unknown fields {}'.format(sorted(unknown)))
+        with self._lock:
+            buf = self._compile()
+            shift = 0
+            for name, field in self._fields.items():
+                field.size_offset += shift
+                field.text_offset += shift
+                if name not in values:
+                    continue
+                text = '{desc}\0{value}\0'.format(
+                    desc=field.desc, value=values[name]).encode(
+                    field.encoding)
+                start = field.text_offset
+                buf[start:start + field.text_length] = text
+                if len(text) != field.text_length:
+                    struct.pack_into('>i', buf, field.size_offset,
+                                     len(text) + 1)
+                    shift += len(text) - field.text_length
+                    field.text_length = len(text)
+            if shift:
+                struct.pack_into('>i', buf, TAG_HEADER.size - 4,
+                                 len(buf) - TAG_HEADER.size)
+            return bytes(buf)
+
+
+def _insert_offset(index):
+    """Offset of the ADTS file to insert tag at, past the first frames."""
+    if not len(index):
+        raise ValueError('No ADTS frame in {}'.format(index.path))
+    if len(index) > DROP_FIRST_N_FRAMES:
+        return index.offsets[DROP_FIRST_N_FRAMES]
+    return min(index.size, index.offsets[-1] + index.lengths[-1])
+
+
+def _untagged_ranges(index):
+    """Yield (offset, count) of parts of the ADTS file between tags."""
+    start = 0
+    for offset, size in index.tags:
+        if offset > start:
+            yield start, offset - start
+        start = offset + size
+    if index.size > start:
+        yield start, index.size - start
+
+
+def _load_tag(tag, tag_file):
     if not tag and (not tag_file or not os.path.isfile(tag_file)):
         raise Exception("Please provide at least one of tag and tag_file")
 
     if not tag:
         with open(tag_file, 'rb') as f:
             tag = f.read()
+    return tag
+
+
+def _copy_range(src, dst, offset, count):
+    """Copy count bytes of src from offset to the position of dst.
+
+    Bytes are copied in the kernel with copy_file_range or sendfile
+    where possible, chunk by chunk in python otherwise."""
+    dst.flush()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    for name in ('copy_file_range', 'sendfile'):
+        if not count or not hasattr(os, name):
+            continue
+        try:
+            while count:
+                if name == 'copy_file_range':
+                    copied = os.copy_file_range(
+                        src_fd, dst_fd, count, offset_src=offset)
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, offset, count)
+                if not copied:  # src shorter than expected
+                    break
+                offset += copied
+                count -= copied
+        except OSError as e:
+            # not supported by the kernel / file systems, try the next
+            if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                               errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+    dst.seek(0, os.SEEK_END)
+    src.seek(offset)
+    while count:
+        chunk = src.read(min(count, CHUNK_SIZE))
+        if not chunk:
+            return
+        dst.write(chunk)
+        count -= len(chunk)
+
+
+def _write_parts(src_file, dst_file, parts):
+    """Write parts, (offset, count) of src_file or bytes, to dst_file."""
+    with open(src_file, 'rb') as src:
+        with open(dst_file, 'wb') as dst:
+            for part in parts:
+                if isinstance(part, tuple):
+                    _copy_range(src, dst, *part)
+                else:
+                    dst.write(part)
+
+
+def _shift_tail(f, offset, shift, size):
+    """Move bytes of f from offset to end forward by shift bytes,
+    from the last chunk backwards so that nothing is overwritten."""
+    end = size
+    while end > offset:
+        start = max(offset, end - CHUNK_SIZE)
+        f.seek(start)
+        chunk = f.read(end - start)
+        f.seek(start + shift)
+        f.write(chunk)
+        end = start
+
+
+def _compact(f, ranges):
+    """Move ranges, (offset, count) of f, to the start of f one after
+    another, chunk by chunk, and truncate f after them."""
+    position = 0
+    for start, count in ranges:
+        if start != position:
+            done = 0
+            while done < count:
+                f.seek(start + done)
+                chunk = f.read(min(CHUNK_SIZE, count - done))
+                f.seek(position + done)
+                f.write(chunk)
+                done += len(chunk)
+        position += count
+    f.truncate(position)
+
+
+def add_id3tag_to_adts(adts_file, output_adts_file=None,
+                       tag=None, tag_file=None, in_place=False):
+    """Add ID3v2 tag to ADTS file.
+
+    Note that ADTS files actually do not support metadata,
+    thus this may produce problematic files.
 
-    index = 0
-    for i in range(DROP_FIRST_N_FRAMES):
-        index = origin.find(b'\xff\xf1', index + 1)
+    Note that this function manipulates binary directly,
+    file already containing tags should not be provided as input,
+    see replace_id3tag_in_adts.
+
+    The tag is inserted after the first frames, found by an ADTSIndex
+    of only these frames, and the rest of the file is copied in the
+    kernel, so time and memory used do not grow with size of the file.
+
+    :param in_place: insert tag into adts_file itself instead of
+        writing output_adts_file, moving the rest of the file forward
+        chunk by chunk; the file is corrupted if interrupted"""
+    tag = _load_tag(tag, tag_file)
+    index = audioheaders.ADTSIndex(adts_file, DROP_FIRST_N_FRAMES + 1)
+    offset = _insert_offset(index)
+    if in_place:
+        with open(adts_file, 'r+b') as f:
+            _shift_tail(f, offset, len(tag), index.size)
+            f.seek(offset)
+            f.write(tag)
+        return
 
     if output_adts_file is None:
         output_adts_file = adts_file + '.tagged'
-    with open(output_adts_file, 'wb') as f:
-        f.write(origin[:index])
-        f.write(tag)
-        f.write(origin[index:])
+    _write_parts(adts_file, output_adts_file,
+                 [(0, offset), tag, (offset, index.size - offset)])
 
 
-def remove_id3tag_from_adts(adts_file, output_adts_file=None):
-    raise Exception("Unimplemented")
+def remove_id3tag_from_adts(adts_file, output_adts_file=None,
+                            in_place=False):
+    """Remove ID3v2 tags from ADTS file, wherever they are.
+
+    :param in_place: remove tags from adts_file itself instead of
+        writing output_adts_file
+    Will return number of tags removed."""
+    index = audioheaders.ADTSIndex.of_file(adts_file)
+    if in_place:
+        if index.tags:
+            with open(adts_file, 'r+b') as f:
+                _compact(f, _untagged_ranges(index))
+        return len(index.tags)
+
+    if output_adts_file is None:
+        output_adts_file = adts_file + '.untagged'
+    _write_parts(adts_file, output_adts_file, _untagged_ranges(index))
+    return len(index.tags)
+
+
+def replace_id3tag_in_adts(adts_file, output_adts_file=None,
+                           tag=None, tag_file=None):
+    """Replace ID3v2 tags of ADTS file with tag, in one pass.
+
+    Existing tags are dropped and tag is inserted where
+    add_id3tag_to_adts would insert it."""
+    tag = _load_tag(tag, tag_file)
+    index = audioheaders.ADTSIndex.of_file(adts_file)
+    offset = _insert_offset(index)
+    parts = []
+    for start, count in _untagged_ranges(index):
+        if tag is not None and start <= offset < start + count:
+            parts += [(start, offset - start), tag,
+                      (offset, start + count - offset)]
+            tag = None
+        else:
+            parts.append((start, count))
+    if tag is not None:  # fewer frames than DROP_FIRST_N_FRAMES
+        parts.append(tag)
+
+    if output_adts_file is None:
+        output_adts_file = adts_file + '.tagged'
+    _write_parts(adts_file, output_adts_file, parts)
+
+
+class ADTSTagFilter(object):
+    """Inject ID3 tags into ADTS bytes chunk by chunk.
+
+    Frame boundaries are tracked by frame headers, tags are inserted
+    before frame first_frame, then every interval frames. Bytes not
+    forming ADTS frames and ID3 tags already in the input are passed
+    through. At most one frame is buffered between chunks.
+
+    The tag may be bytes, an ID3Tag (its current content is injected,
+    so it can be updated between injections), or a callable called
+    with the frame number to get bytes, None to skip this point, e.g.
+    lambda n: template.render(seq=n)."""
+
+    def __init__(self, tag, first_frame=DROP_FIRST_N_FRAMES, interval=None):
+        """Filter.
+
+        :param tag: tag to inject, see class doc, replaced by set_tag
+        :param first_frame: number of frame the first tag goes before
+        :param interval: frames between tags, None to inject only once"""
+        self._tag = tag
+        self._first_frame = first_frame
+        self._interval = interval
+        self._pending = b''  # unfinished frame of the last chunk
+        self._skip = 0  # bytes of an ID3 tag of input still to pass
+        self._synced = False
+        self.frames = 0  # frames passed
+        self.tags = 0  # tags injected
+
+    def set_tag(self, tag):
+        """Inject tag from the next injection point on."""
+        self._tag = tag
+
+    def _due(self):
+        n = self.frames - self._first_frame
+        if n == 0:
+            return True
+        return n > 0 and self._interval and n % self._interval == 0
+
+    def _render(self):
+        tag = self._tag
+        if callable(tag):
+            return tag(self.frames)
+        if isinstance(tag, ID3Tag):
+            return tag.view
+        return tag
+
+    def feed(self, chunk):
+        """Filter a chunk of input.
+
+        Will return a list of bytes-like chunks of output."""
+        data = self._pending + bytes(chunk) if self._pending else \
+            bytes(chunk)
+        view = memoryview(data)
+        output = []
+        start = pos = 0
+        size = len(data)
+        while pos < size:
+            if self._skip:
+                step = min(self._skip, size - pos)
+                pos += step
+                self._skip -= step
+                continue
+            header = audioheaders.adts_header(data, pos)
+            if header is None:
+                if size - pos < 10:  # may be an unfinished header
+                    break
+                self._skip = audioheaders.id3v2_size(data, pos)
+                if not self._skip:  # lost sync
+                    self._synced = False
+                    pos = data.find(b'\xff', pos + 1)
+                    if pos < 0:
+                        pos = size
+                continue
+            frame_length = header[0]
+            if not self._synced:  # confirm by the next header
+                if pos + frame_length + 7 > size:
+                    break
+                if audioheaders.adts_header(
+                        data, pos + frame_length) is None:
+                    pos += 1
+                    continue
+                self._synced = True
+            if pos + frame_length > size:
+                break
+            if self._due():
+                tag = self._render()
+                if tag:
+                    if pos > start:
+                        output.append(view[start:pos])
+                    output.append(tag)
+                    start = pos
+                    self.tags += 1
+            self.frames += 1
+            pos += frame_length
+        if pos > start:
+            output.append(view[start:pos])
+        self._pending = data[pos:]
+        return output
+
+    def flush(self):
+        """Get the rest of input, at end of input.
+
+        Will return a list of bytes-like chunks of output."""
+        pending, self._pending = self._pending, b''
+        return [pending] if pending else []
+
+
+def inject_id3tags(chunks, tag, **kwargs):
+    """Yield chunks of ADTS input with tags injected.
+
+    :param chunks: iterable of bytes-like chunks of ADTS input
+    Other params are those of ADTSTagFilter."""
+    tag_filter = ADTSTagFilter(tag, **kwargs)
+    for chunk in chunks:
+        for data in tag_filter.feed(chunk):
+            yield data
+    for data in tag_filter.flush():
+        yield data
+
+
+class ADTSTagReader(io.RawIOBase):
+    """Readable file of ADTS input of a file object with tags injected.
+
+    Wrap with io.BufferedReader for buffered reads."""
+
+    def __init__(self, fileobj, tag, chunk_size=STREAM_CHUNK_SIZE,
+                 **kwargs):
+        """Reader.
+
+        :param fileobj: binary file object of ADTS input, like a pipe
+        :param chunk_size: bytes read from fileobj at a time
+        Other params are those of ADTSTagFilter."""
+        super(ADTSTagReader, self).__init__()
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self.filter = ADTSTagFilter(tag, **kwargs)
+        self._output = collections.deque()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._output and not self._eof:
+            chunk = self._fileobj.read(self._chunk_size)
+            if chunk:
+                self._output.extend(self.filter.feed(chunk))
+            else:
+                self._eof = True
+                self._output.extend(self.filter.flush())
+        if not self._output:
+            return 0
+        data = self._output.popleft()
+        n = min(len(b), len(data))
+        b[:n] = data[:n]
+        if n < len(data):
+            self._output.appendleft(memoryview(data)[n:])
+        return n
+
+
+class TaggingReport(collections.namedtuple(
+        'TaggingReport', 'path output_path size elapsed error')):
+    """Result of tagging a segment by tag_segments."""
+
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        """Bytes of the segment tagged per second."""
+        return self.size / max(self.elapsed, 1e-6)
+
+
+def tag_segments(segments, template, values=None, output_dir=None,
+                 in_place=False, workers=4):
+    """Add tags rendered from template to ADTS segments in parallel.
+
+    :param segments: list of paths of segments, or a directory whose
+        files with SEGMENT_EXTENSIONS are tagged in order of names
+    :param template: an ID3TagTemplate
+    :param values: called with (path, index of segment) to get dict of
+        values of fields to render, None to keep values of template
+    :param output_dir: directory to write tagged segments to, with the
+        same names; None to write <segment>.tagged next to them
+    :param in_place: tag segments themselves, output_dir is ignored
+    :param workers: number of threads
+    Will return a list of TaggingReport in order of segments, with
+    size in bytes and elapsed seconds of each file, error is None
+    or the exception raised."""
+    if isinstance(segments, str):
+        segments = [os.path.join(segments, fn)
+                    for fn in sorted(os.listdir(segments))
+                    if fn.lower().endswith(SEGMENT_EXTENSIONS)]
+    logger = logging.getLogger(__name__)
+
+    def tag_segment(i, path):
+        start_time = time.time()
+        output_path = None
+        if in_place:
+            output_path = path
+        elif output_dir is not None:
+            output_path = os.path.join(output_dir, os.path.basename(path))
+        try:
+            tag = template.render(**(values(path, i) if values else {}))
+            add_id3tag_to_adts(path, output_adts_file=output_path, tag=tag,
+                               in_place=in_place)
+            error = None
+        except Exception as e:
+            logger.warning('Failed to tag %s: %r', path, e)
+            error = e
+        if output_path is None:
+            output_path = path + '.tagged'
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        return TaggingReport(path, output_path, size,
+                             time.time() - start_time, error)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(workers) as executor:
+        reports = list(executor.map(tag_segment, range(len(segments)),
+                                    segments))
+    elapsed = time.time() - start_time
+    size = sum(report.size for report in reports)
+    logger.info('Tagged %d segments (%d failed), %.1f MB in %.2fs, '
+                '%.1f MB/s', len(reports),
+                sum(1 for report in reports if report.error is not None),
+                size / 1e6, elapsed, size / 1e6 / max(elapsed, 1e-6))
+    return reports
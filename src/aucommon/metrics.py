@@ -0,0 +1,117 @@
+"""
+Metrics of AudioProber Events in Prometheus Text Format
+"""
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# labels of events kept in metrics, host only if per_host
+LABELS = ('stage', 'proto', 'outcome')
+
+
+def _format_labels(labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels) + '}'
+
+
+class ProbeMetrics(object):
+
+    """Counters and histograms of AudioProber events.
+
+    Instances are callable so that they can be passed
+    as instrument of AudioProber, like any callback:
+
+        metrics = ProbeMetrics()
+        AudioProber(url, instrument=metrics)
+        print(metrics.render())"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, per_host=False,
+                 prefix='auprobe', callback=None):
+        """Metrics.
+
+        :param buckets: upper bounds of histogram buckets in seconds
+        :param per_host: add host label to metrics, to find slow hosts
+        :param prefix: prefix of metric names
+        :param callback: another instrument called with every event"""
+        self._buckets = tuple(sorted(buckets))
+        self._labels = LABELS + (('host',) if per_host else ())
+        self._prefix = prefix
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._events = {}
+        self._retries = {}
+        self._hedges = {}
+        self._bytes = {}
+        self._output_bytes = {}
+        self._histograms = {}  # [bucket counts, sum, count]
+
+    def __call__(self, event):
+        """Record an event dict emitted by AudioProber."""
+        labels = tuple((k, event.get(k) or '') for k in self._labels)
+        with self._lock:
+            self._events[labels] = self._events.get(labels, 0) + 1
+            if event.get('retry'):
+                self._retries[labels] = self._retries.get(labels, 0) + 1
+            if event.get('hedged'):
+                self._hedges[labels] = self._hedges.get(labels, 0) + 1
+            if event.get('bytes'):
+                self._bytes[labels] = \
+                    self._bytes.get(labels, 0) + event['bytes']
+            if event.get('output_bytes'):
+                self._output_bytes[labels] = \
+                    self._output_bytes.get(labels, 0) + event['output_bytes']
+            elapsed = event.get('elapsed')
+            if elapsed is not None:
+                histogram = self._histograms.setdefault(
+                    labels, [[0] * len(self._buckets), 0.0, 0])
+                index = bisect.bisect_left(self._buckets, elapsed)
+                if index < len(self._buckets):
+                    histogram[0][index] += 1
+                histogram[1] += elapsed
+                histogram[2] += 1
+        if self._callback is not None:
+            self._callback(event)
+
+    def render(self):
+        """Render metrics in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, help_text, values in (
+                    ('events_total', 'Events of probing stages.',
+                     self._events),
+                    ('retries_total', 'Retried ffprobe attempts.',
+                     self._retries),
+                    ('hedges_total', 'Hedged ffprobe attempts.',
+                     self._hedges),
+                    ('bytes_total', 'Bytes of input fetched or captured.',
+                     self._bytes),
+                    ('output_bytes_total',
+                     'Bytes of output read from ffprobe and ffmpeg.',
+                     self._output_bytes)):
+                name = '{}_{}'.format(self._prefix, name)
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for labels, value in sorted(values.items()):
+                    lines.append('{}{} {}'.format(
+                        name, _format_labels(labels), value))
+
+            name = '{}_stage_seconds'.format(self._prefix)
+            lines.append('# HELP {} Duration of probing stages.'.format(name))
+            lines.append('# TYPE {} histogram'.format(name))
+            for labels, (counts, total, count) in sorted(
+                    self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(self._buckets, counts):
+                    cumulative += n
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(labels + (('le', bound),)),
+                        cumulative))
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels + (('le', '+Inf'),)), count))
+                lines.append('{}_sum{} {}'.format(
+                    name, _format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(
+                    name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
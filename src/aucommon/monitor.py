@@ -0,0 +1,328 @@
+"""
+Continuous Monitoring of Live Streams
+
+One long-lived ffmpeg connected to best_url of a stream reports
+volume of the track, its channels and its mid-mix every 100 ms, and
+momentary / short-term loudness of the track; they are rolled up into
+one event per window:
+
+    {'stage': 'monitor', 'outcome': 'window', 'url': ..., 'host': ...,
+     't': seconds of stream, 'time': unix time,
+     'volume': {channel: {'volume_mean': ..., 'volume_max': ...}},
+     'momentary': max momentary loudness, 'short_term': short-term loudness,
+     'flags': {'silent': ..., 'inverted': ..., 'll': ..., 'rr': ..., ...}}
+
+ffmpeg is restarted with exponential backoff if the connection drops
+or stalls, and the stream is probed again if a connection gave nothing.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import shlex
+import sys
+import threading
+import time
+
+from cocommon.utils.compat import subprocess
+from cocommon.quick_config import config_log
+
+from aucommon.auprobe import (
+    AudioProber, CHANNEL_MERGED, CHANNEL_ORI, EBUR128_FRAME_RE,
+    MAX_LINE_LENGTH, NONEXIST, track_health)
+from aucommon.pcmanalysis import VOLUME_MIN
+
+WINDOW = 10  # seconds of stream rolled up into one event
+FRAME_LEN = 0.1  # seconds of stream of each astats frame
+STALL_TIMEOUT = 30  # seconds without output before reconnecting
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+ASTATS_KEYS = ('lavfi.astats.Overall.RMS_level',
+               'lavfi.astats.Overall.Peak_level')
+
+
+class StreamMonitor(object):
+
+    """Monitor a live stream with one long-lived ffmpeg."""
+
+    def __init__(self, url, callback, window=WINDOW,
+                 stall_timeout=STALL_TIMEOUT, backoff_min=BACKOFF_MIN,
+                 backoff_max=BACKOFF_MAX, **prober_options):
+        """Monitor.
+
+        :param url: url of the stream
+        :param callback: called with a dict for every event,
+            events of windows and of connections (outcome connected,
+            disconnected), like instrument of AudioProber
+        :param window: seconds of stream rolled up into one event
+        :param stall_timeout: seconds without output of ffmpeg
+            before reconnecting
+        :param backoff_min: seconds to wait before the first reconnection
+        :param backoff_max: max seconds to wait before reconnecting
+        :param prober_options: arguments of AudioProber to probe url"""
+        self._url = url
+        self._callback = callback
+        self._window = window
+        self._stall_timeout = stall_timeout
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._prober_options = prober_options
+        self._host = AudioProber.host_of(url)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._proc = None
+        self._input = None  # (url, input_options, track_index, channels)
+        self._logger = logging.getLogger(__name__)
+
+    def _emit(self, outcome, **fields):
+        fields.update(stage='monitor', outcome=outcome, url=self._url,
+                      host=self._host, time=time.time())
+        try:
+            self._callback(fields)
+        except Exception:
+            self._logger.exception('Callback failed on %s', fields)
+
+    def stop(self):
+        """Stop monitoring, run() returns soon after."""
+        self._stop.set()
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                self._proc.kill()
+
+    def run(self):
+        """Monitor until stop(), reconnecting with backoff."""
+        failures = 0
+        while not self._stop.is_set():
+            windows = 0
+            try:
+                if self._input is None:
+                    self._input = self._probe()
+                windows = self._run_once()
+            except Exception as e:
+                self._logger.warning('Monitoring %s failed: %r', self._url, e)
+                self._emit('error', error=repr(e))
+            if self._stop.is_set():
+                break
+            if windows:
+                failures = 0
+            else:  # nothing from this connection, probe again
+                failures += 1
+                self._input = None
+            delay = min(self._backoff_max,
+                        self._backoff_min * 2 ** max(0, failures - 1))
+            delay *= random.uniform(0.5, 1.0)
+            self._logger.info('Reconnecting to %s in %.1fs', self._url, delay)
+            self._stop.wait(delay)
+
+    def _probe(self):
+        """Probe url for best track and its ffmpeg input.
+
+        Will return a tuple:
+            (url, input_options, track_index, channels)"""
+        with AudioProber(self._url, **self._prober_options) as ap:
+            best_track = ap.best_track
+            ap.close()  # drop http feed if any, read url directly
+            url, input_options, index = ap._analysis_input()
+        channels = best_track['channels']
+        if channels == NONEXIST:
+            channels = 2
+        return url, input_options, index, channels
+
+    def _cmd(self):
+        """Get ffmpeg command and module names of its filter graph.
+
+        Will return a tuple:
+            (cmd, modules), modules keyed by module index"""
+        url, input_options, index, channels = self._input
+        chains = [(None, CHANNEL_ORI, 'cfull')]
+        for i in range(channels):
+            chains.append(('c{}'.format(i), i, 'c{}'.format(i)))
+        if channels == 2:
+            chains.append(('0.5*c0+0.5*c1', CHANNEL_MERGED, 'cinverted'))
+
+        filter_complex_list = []
+        modules = {}
+        module_index = 0
+        for pan, channel, label in chains:
+            filters = []
+            if pan is not None:
+                filters.append('pan=mono|c0={}'.format(pan))
+            filters += [
+                'aresample=48000',
+                'asetnsamples=n={}:p=0'.format(int(48000 * FRAME_LEN)),
+                'astats=metadata=1:reset=1',
+                ] + ['ametadata=mode=print:key={}'.format(key)
+                     for key in ASTATS_KEYS]
+            if pan is None:
+                filters.append('ebur128=framelog=info')
+            for name in filters:
+                modules[module_index] = (name.split('=')[0], channel)
+                module_index += 1
+            filter_complex_list.append('[0:{}]{}[{}]'.format(
+                index, ','.join(filters), label))
+
+        cmd = ['ffmpeg', '-nostats'] + input_options + \
+            ['-i', url, '-filter_complex', ';'.join(filter_complex_list)]
+        for _, _, label in chains:
+            cmd += ['-map', '[{}]'.format(label), '-f', 'null', '-']
+        return cmd, modules
+
+    def _run_once(self):
+        """Run ffmpeg until it exits, emitting an event per window.
+
+        Will return number of windows emitted."""
+        cmd, modules = self._cmd()
+        channels = self._input[3]
+        with self._lock:
+            if self._stop.is_set():
+                return 0
+            self._proc = proc = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE)
+        self._emit('connected', cmd=cmd)
+        last_output = [time.time()]
+
+        def check_stall():
+            while proc.poll() is None:
+                if time.time() - last_output[0] > self._stall_timeout:
+                    self._logger.warning('%s stalled', self._url)
+                    proc.kill()
+                    return
+                time.sleep(1)
+
+        checker = threading.Thread(target=check_stall)
+        checker.daemon = True
+        checker.start()
+
+        window = _Window(self._window)
+        windows = 0
+        try:
+            for line in iter(
+                    lambda: proc.stderr.readline(MAX_LINE_LENGTH), b''):
+                last_output[0] = time.time()
+                if window.feed(line.decode('utf-8', 'ignore').strip(),
+                               modules):
+                    event = window.result(channels)
+                    window = _Window(self._window, window.end)
+                    windows += 1
+                    self._emit('window', **event)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stderr.close()
+            proc.wait()
+            with self._lock:
+                self._proc = None
+        self._emit('disconnected', exit_code=proc.returncode,
+                   windows=windows)
+        return windows
+
+
+class _Window(object):
+
+    """Frames of one window of a monitored stream."""
+
+    def __init__(self, length, start=0.0):
+        self.start = start
+        self.end = start + length
+        self._power = {}  # sums of RMS power keyed by channel
+        self._frames = {}
+        self._peak = {}
+        self._momentary = None
+        self._short_term = None
+        self._t = None
+
+    def feed(self, line, modules):
+        """Parse a line of ffmpeg output.
+
+        Will return True once the window is complete."""
+        if line.startswith('[Parsed_ametadata_') and '=' in line:
+            name, _, value = line.split('] ', 1)[-1].partition('=')
+            try:
+                value = float(value)  # -inf for silence
+            except ValueError:
+                return False
+            if value != value:  # nan
+                return False
+            _, channel = modules[int(line.split()[0].split('_')[-1])]
+            if name == ASTATS_KEYS[0]:
+                self._power[channel] = self._power.get(channel, 0.0) + \
+                    10 ** (value / 10.0)
+                self._frames[channel] = self._frames.get(channel, 0) + 1
+            elif name == ASTATS_KEYS[1]:
+                self._peak[channel] = max(
+                    self._peak.get(channel, value), value)
+        elif line.startswith('[Parsed_ebur128_') and ' t:' in line:
+            values = dict((k, float(v))
+                          for k, v in EBUR128_FRAME_RE.findall(line))
+            if 't' not in values:
+                return False
+            self._t = values['t']
+            if 'M' in values:
+                self._momentary = values['M'] if self._momentary is None \
+                    else max(self._momentary, values['M'])
+            self._short_term = values.get('S', self._short_term)
+            return self._t >= self.end
+        return False
+
+    def result(self, channels):
+        """Roll frames up into an event.
+
+        Volumes of silence (-inf dB) are clamped to VOLUME_MIN, so that
+        events stay valid json."""
+        volume = {}
+        for channel, power in self._power.items():
+            mean = power / self._frames[channel]
+            peak = self._peak.get(channel)
+            volume[channel] = {
+                'volume_mean': max(VOLUME_MIN, round(10 * math.log10(mean), 1))
+                if mean > 0 else VOLUME_MIN,
+                'volume_max': None if peak is None else max(VOLUME_MIN, peak),
+                }
+        flags = track_health(volume, {CHANNEL_ORI: self._short_term},
+                             channels)
+        return {
+            't': self._t,
+            'volume': volume,
+            'momentary': self._momentary,
+            'short_term': self._short_term,
+            'flags': flags,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='auprobe monitor',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Print events of a live stream as json lines.')
+    parser.add_argument('url', help='url of live stream')
+    parser.add_argument('-i', '--input_options',
+                        type=lambda x: shlex.split(x),
+                        default=[], help='prober')
+    parser.add_argument('-w', '--window', type=float, default=WINDOW,
+                        help='seconds of stream of each event')
+    parser.add_argument('--stall_timeout', type=float, default=STALL_TIMEOUT,
+                        help='seconds without output before reconnecting')
+    parser.add_argument('--backoff_max', type=float, default=BACKOFF_MAX,
+                        help='max seconds to wait before reconnecting')
+    parser.add_argument('--force_proto', action='store_true',
+                        help='use scheme in url as proto')
+    args = parser.parse_args(argv)
+
+    config_log.config_log('/tmp', 'aumonitor.log', 'INFO')
+    logging.getLogger(__name__).info('Arguments: %s', args)
+
+    def print_event(event):
+        sys.stdout.write(json.dumps(event) + '\n')
+        sys.stdout.flush()
+
+    monitor = StreamMonitor(
+        args.url, print_event, args.window, args.stall_timeout,
+        backoff_max=args.backoff_max, input_options=args.input_options,
+        force_proto=args.force_proto)
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
@@ -0,0 +1,215 @@
+"""
+NumPy Analysis of Volume and Loudness from Raw Float PCM
+
+Reproduces what ffmpeg volumedetect and ebur128 report for a track,
+its channels and the mid-mix of a stereo track, from one decode.
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, see extras_require of setup.py
+    np = None
+
+CHANNEL_ORI = -1  # same as auprobe
+CHANNEL_MERGED = -2
+VOLUME_MIN = -91.0  # volumedetect reports about -91 dB for silence
+LOUDNESS_MIN = -70.0  # ebur128 reports -70 LUFS if all blocks are gated
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+SURROUND_WEIGHT = 1.41
+SAMPLE_BYTES = 4  # f32le
+
+
+def k_weighting_power(sample_rate, n):
+    """Squared magnitude response of BS.1770 K-weighting at rfft bins.
+
+    :param sample_rate: sample rate of signal
+    :param n: length of rfft input"""
+    # high shelf, same derivation as libebur128 for any sample rate
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = math.pow(10.0, gain / 20.0)
+    vb = math.pow(vh, 0.4996667741545416)
+    a0 = 1.0 + k / q + k * k
+    b_shelf = [(vh + vb * k / q + k * k) / a0,
+               2.0 * (k * k - vh) / a0,
+               (vh - vb * k / q + k * k) / a0]
+    a_shelf = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    # high pass
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1.0 + k / q + k * k
+    b_hp = [1.0, -2.0, 1.0]
+    a_hp = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n))
+
+    def response(b, a):
+        return (b[0] + b[1] * z + b[2] * z * z) / \
+            (a[0] + a[1] * z + a[2] * z * z)
+
+    return np.abs(response(b_shelf, a_shelf) * response(b_hp, a_hp)) ** 2
+
+
+def channel_weights(channels):
+    """Weights of channels for loudness of all channels."""
+    if channels == 6:  # 5.1: FL FR FC LFE BL BR
+        return [1.0, 1.0, 1.0, 0.0, SURROUND_WEIGHT, SURROUND_WEIGHT]
+    return [1.0] * channels
+
+
+def integrated_loudness(energies):
+    """Gated integrated loudness from energies of 100ms sub-blocks.
+
+    Blocks of 400ms overlapping by 75% are made of 4 sub-blocks."""
+    energies = np.asarray(energies, dtype=np.float64)
+    if len(energies) < 4:
+        return LOUDNESS_MIN
+    blocks = (energies[:-3] + energies[1:-2] +
+              energies[2:-1] + energies[3:]) / 4.0
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10.0 * np.log10(blocks)
+    gated = blocks[block_loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return LOUDNESS_MIN
+    relative_gate = -0.691 + 10.0 * math.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(block_loudness > ABSOLUTE_GATE) &
+                   (block_loudness > relative_gate)]
+    if not len(gated):
+        return LOUDNESS_MIN
+    return max(LOUDNESS_MIN, -0.691 + 10.0 * math.log10(gated.mean()))
+
+
+def to_db(power):
+    if power <= 0:
+        return VOLUME_MIN
+    return max(VOLUME_MIN, 10.0 * math.log10(power))
+
+
+class PCMAnalyzer(object):
+
+    """Block by block analysis of interleaved float PCM.
+
+    Signals analyzed are keyed the same way as AudioProber.volume:
+        CHANNEL_ORI: all channels
+        0 .. channels - 1: each channel
+        CHANNEL_MERGED: 0.5 * c0 + 0.5 * c1, only for stereo"""
+
+    def __init__(self, sample_rate, channels):
+        if np is None:
+            raise ImportError('numpy is required by PCMAnalyzer')
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.analyzed_samples = 0  # per channel
+
+        self._sub_len = sample_rate // 10  # samples of a 100ms sub-block
+        weight = np.full(self._sub_len // 2 + 1, 2.0)
+        weight[0] = 1.0
+        if self._sub_len % 2 == 0:
+            weight[-1] = 1.0
+        self._bin_weight = k_weighting_power(sample_rate, self._sub_len) * \
+            weight / float(self._sub_len) ** 2
+        self._channel_weights = np.array(channel_weights(channels))
+
+        self._signals = list(range(channels))
+        if channels == 2:
+            self._signals.append(CHANNEL_MERGED)
+        self._sum_squares = dict.fromkeys(self._signals, 0.0)
+        self._peak = dict.fromkeys(self._signals, 0.0)
+        # K-weighted mean square of every sub-block
+        self._energies = {k: [] for k in self._signals + [CHANNEL_ORI]}
+        self._pending = b''
+        self._rest = np.zeros((0, channels), dtype=np.float32)
+
+    def feed(self, data):
+        """Analyze bytes of interleaved f32le PCM."""
+        data = self._pending + data
+        usable = len(data) - len(data) % (SAMPLE_BYTES * self.channels)
+        self._pending = data[usable:]
+        frames = np.frombuffer(data[:usable], dtype='<f4').reshape(
+            -1, self.channels)
+        if len(self._rest):
+            frames = np.concatenate((self._rest, frames))
+        n_sub = len(frames) // self._sub_len
+        usable = n_sub * self._sub_len
+        self._rest = frames[usable:]
+        if n_sub:
+            self._analyze(frames[:usable], n_sub)
+
+    def _signal_data(self, frames):
+        """Yield (signal, samples) of all signals of frames."""
+        for channel in range(self.channels):
+            yield channel, frames[:, channel]
+        if self.channels == 2:
+            yield CHANNEL_MERGED, 0.5 * frames[:, 0] + 0.5 * frames[:, 1]
+
+    def _update_volume(self, frames):
+        for signal, samples in self._signal_data(frames):
+            samples = samples.astype(np.float64)
+            self._sum_squares[signal] += float(np.dot(samples, samples))
+            self._peak[signal] = max(
+                self._peak[signal], float(np.abs(samples).max()))
+        self.analyzed_samples += len(frames)
+
+    def _analyze(self, frames, n_sub):
+        self._update_volume(frames)
+        energies = {}
+        for signal, samples in self._signal_data(frames):
+            spectrum = np.fft.rfft(
+                samples.astype(np.float64).reshape(n_sub, self._sub_len))
+            energies[signal] = (
+                spectrum.real ** 2 + spectrum.imag ** 2).dot(
+                    self._bin_weight)
+            self._energies[signal].extend(energies[signal].tolist())
+        ori = sum(self._channel_weights[channel] * energies[channel]
+                  for channel in range(self.channels))
+        self._energies[CHANNEL_ORI].extend(ori.tolist())
+
+    @property
+    def signals(self):
+        """All signals analyzed, CHANNEL_ORI included."""
+        return [CHANNEL_ORI] + self._signals
+
+    def loudness_of(self, signal):
+        """Integrated loudness of signal analyzed so far."""
+        return integrated_loudness(self._energies[signal])
+
+    def volume_mean_of(self, signal):
+        """Mean volume of a channel or mid-mix analyzed so far."""
+        return to_db(
+            self._sum_squares[signal] / max(self.analyzed_samples, 1))
+
+    def result(self):
+        """Get volume and loudness keyed by channel.
+
+        Will return a tuple:
+            (volume, loudness)"""
+        if len(self._rest):
+            self._update_volume(self._rest)
+            self._rest = self._rest[:0]
+        n = max(self.analyzed_samples, 1)
+
+        volume = {}
+        for signal in self._signals:
+            volume[signal] = {
+                'volume_max': round(to_db(self._peak[signal] ** 2), 1),
+                'volume_mean': round(to_db(self._sum_squares[signal] / n), 1),
+                }
+        volume[CHANNEL_ORI] = {
+            'volume_max': max(volume[channel]['volume_max']
+                              for channel in range(self.channels)),
+            'volume_mean': round(to_db(
+                sum(self._sum_squares[channel]
+                    for channel in range(self.channels)) /
+                (n * self.channels)), 1),
+            }
+
+        loudness = {}
+        for signal in self.signals:
+            loudness[signal] = round(self.loudness_of(signal), 1)
+        return volume, loudness
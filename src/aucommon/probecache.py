@@ -0,0 +1,144 @@
+"""
+Persistent Cache of Probing Results (SQLite, local only)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_TTLS = {
+    'tracks': 24 * 3600,  # protocol, con_time and audio tracks
+    'analysis': 24 * 3600,  # volume and loudness of best track
+}
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+    'rtsp': 554,
+    'rtmp': 1935,
+    'mms': 1755,
+}
+
+
+def normalize_url(url):
+    """Normalize url: lower scheme and host, drop default port and fragment."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, parts.port)
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo += ':' + parts.password
+        netloc = userinfo + '@' + netloc
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def make_key(url, input_options=(), force_proto=False):
+    """Make cache key of input.
+
+    Local files are keyed by path, size and mtime,
+    urls are keyed by normalized url, input_options and force_proto,
+    as the protocol of a forced url is not probed among others."""
+    if '://' not in url:
+        st = os.stat(url)
+        base = 'file:{}:{}:{}'.format(
+            os.path.abspath(url), st.st_size, st.st_mtime)
+    else:
+        base = normalize_url(url)
+    key = base + ' ' + json.dumps(list(input_options))
+    if force_proto:
+        key += ' force_proto'
+    return key
+
+
+class ProbeCache(object):
+
+    """On-disk cache of probing results with per-kind TTLs.
+
+    Entries are evicted least recently used first
+    once there are more than max_entries of them."""
+
+    def __init__(self, path, max_entries=10000, ttls=None):
+        """Cache.
+
+        :param path: path of the SQLite database
+        :param max_entries: max number of entries of all kinds
+        :param ttls: a dict of seconds keyed by kind, see DEFAULT_TTLS"""
+        self._path = path
+        self._max_entries = max_entries
+        self._ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self._ttls.update(ttls)
+        self._lock = threading.Lock()
+        self._counters = {kind: {'hits': 0, 'misses': 0}
+                          for kind in self._ttls}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS probe_cache ('
+                'kind TEXT, key TEXT, value TEXT, '
+                'created REAL, accessed REAL, '
+                'PRIMARY KEY (kind, key))')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS probe_cache_accessed '
+                'ON probe_cache (accessed)')
+
+    @property
+    def stats(self):
+        """Hit / miss counters keyed by kind."""
+        with self._lock:
+            return {kind: dict(v) for kind, v in self._counters.items()}
+
+    def get(self, kind, key):
+        """Get a cached value, None if missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            counters = self._counters.setdefault(
+                kind, {'hits': 0, 'misses': 0})
+            row = self._conn.execute(
+                'SELECT value, created FROM probe_cache '
+                'WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+            if row is not None and \
+                    now - row[1] > self._ttls.get(kind, 0):
+                self._conn.execute(
+                    'DELETE FROM probe_cache WHERE kind = ? AND key = ?',
+                    (kind, key))
+                row = None
+            if row is None:
+                counters['misses'] += 1
+                return None
+            counters['hits'] += 1
+            self._conn.execute(
+                'UPDATE probe_cache SET accessed = ? '
+                'WHERE kind = ? AND key = ?', (now, kind, key))
+        return json.loads(row[0])
+
+    def set(self, kind, key, value):
+        """Cache a json serializable value."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probe_cache VALUES (?, ?, ?, ?, ?)',
+                (kind, key, json.dumps(value), now, now))
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM probe_cache').fetchone()[0]
+            if count > self._max_entries:
+                self._conn.execute(
+                    'DELETE FROM probe_cache WHERE rowid IN ('
+                    'SELECT rowid FROM probe_cache '
+                    'ORDER BY accessed LIMIT ?)',
+                    (count - self._max_entries,))
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM probe_cache')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,345 @@
+"""
+Probe Daemon: serve probing jobs over a Unix socket or local HTTP
+
+Jobs are run by a shared worker pool with a shared cache, metrics and
+per-host state, so that callers do not pay interpreter startup and
+imports for every url.
+
+    POST /probe    {"url": ..., "options": {...}} -> {"result": ...}
+    GET  /metrics  metrics in Prometheus text format
+    GET  /stats    per-host state and cache counters
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from http import client as http_client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from cocommon.quick_config import config_log
+
+from aucommon import auprobe
+from aucommon import hoststats
+from aucommon import httpfeed
+from aucommon import metrics
+from aucommon import probecache
+from aucommon import scheduler
+
+DEFAULT_ADDRESS = 'unix:/tmp/auprobed.sock'
+# options of a job passed through to AudioProber
+JOB_OPTIONS = ('input_options', 'repeat_times', 'timeout', 'retry_times',
+               'min_len', 'max_len', 'force_proto', 'race_protocols',
+               'spool', 'engine', 'adaptive', 'tolerance', 'hedge',
+               'tiered', 'parse_headers', 'scan_headers', 'all_tracks',
+               'segments', 'segment_len')
+
+
+class ProbeError(Exception):
+    pass
+
+
+def parse_address(address):
+    """Parse unix:/path or host:port.
+
+    Will return a tuple:
+        (family, address)"""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def decode_result(result):
+    """Restore int channel keys of volume and loudness lost in json."""
+    for k in ('volume', 'loudness'):
+        if isinstance(result.get(k), dict):
+            result[k] = dict((int(channel), v)
+                             for channel, v in result[k].items())
+    if result.get('track_analysis') is not None:
+        result['track_analysis'] = auprobe.decode_track_analysis(
+            result['track_analysis'])
+    return result
+
+
+class HostState(object):
+
+    """Probing state shared by all jobs of the same host."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def record(self, host, ok, elapsed, con_time=None):
+        with self._lock:
+            state = self._hosts.setdefault(host, {
+                'jobs': 0, 'failures': 0, 'elapsed': 0.0,
+                'last_con_time': None, 'last_seen': None,
+                })
+            state['jobs'] += 1
+            if not ok:
+                state['failures'] += 1
+            state['elapsed'] += elapsed
+            if con_time is not None:
+                state['last_con_time'] = con_time
+            state['last_seen'] = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return dict((host, dict(state))
+                        for host, state in self._hosts.items())
+
+
+class ProbeService(object):
+
+    """Worker pool running probing jobs with shared state."""
+
+    def __init__(self, workers=8, cache=None, per_host=2,
+                 per_host_rate=None, history=None, http_pool=None,
+                 spool_dir=None):
+        """Service.
+
+        :param workers: max number of jobs run at the same time
+        :param cache: a probecache.ProbeCache shared by all jobs
+        :param per_host: max number of connections to one host at the
+            same time, see scheduler.HostScheduler
+        :param per_host_rate: max number of jobs of one host started
+            per second
+        :param history: a hoststats.HostHistory shared by all jobs
+        :param http_pool: a httpfeed.SessionPool shared by all jobs
+        :param spool_dir: directory of captures of jobs with spool"""
+        self.cache = cache
+        self.history = history
+        self.http_pool = http_pool
+        self.spool_dir = spool_dir
+        self.metrics = metrics.ProbeMetrics(per_host=True)
+        self.hosts = HostState()
+        self._scheduler = scheduler.HostScheduler(
+            workers, per_host, per_host_rate)
+        self._logger = logging.getLogger(__name__)
+
+    def probe(self, url, **options):
+        """Probe url on the worker pool, block until done."""
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ProbeError('Unknown options: {}'.format(
+                ', '.join(sorted(unknown))))
+        return self._scheduler.submit_weighted(
+            auprobe.AudioProber.host_of(url),
+            auprobe.AudioProber.connections_of(url, **options),
+            self._probe, url, options).result()
+
+    def _probe(self, url, options):
+        start_time = time.time()
+        host = auprobe.AudioProber.host_of(url)
+        try:
+            result = auprobe.probe_and_select_from_stream(
+                url, cache=self.cache, history=self.history,
+                http_pool=self.http_pool, spool_dir=self.spool_dir,
+                instrument=self.metrics, **options)
+        except Exception:
+            self.hosts.record(host, False, time.time() - start_time)
+            self._logger.exception('Failed to probe %s', url)
+            raise
+        self.hosts.record(host, True, time.time() - start_time,
+                          result.get('con_time'))
+        return result
+
+    def stats(self):
+        return {
+            'hosts': self.hosts.snapshot(),
+            'cache': self.cache.stats if self.cache is not None else None,
+            }
+
+    def shutdown(self):
+        self._scheduler.shutdown()
+        if self.history is not None:
+            self.history.save()
+        if self.http_pool is not None:
+            self.http_pool.close()
+
+
+class ProbeRequestHandler(BaseHTTPRequestHandler):
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, fmt, *args):
+        logging.getLogger(__name__).debug(
+            '%s %s', self.address_string(), fmt % args)
+
+    def _reply(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self._reply(200, service.metrics.render().encode('utf-8'),
+                        'text/plain; version=0.0.4')
+        elif self.path == '/stats':
+            self._reply(200, service.stats())
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/probe':
+            self._reply(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            url = job['url']
+            options = job.get('options') or {}
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': 'Bad job: {!r}'.format(e)})
+            return
+        try:
+            result = self.server.service.probe(url, **options)
+        except (ProbeError, auprobe.InvalidURL, ValueError) as e:
+            self._reply(422, {'error': repr(e)})
+        except Exception as e:
+            self._reply(500, {'error': repr(e)})
+        else:
+            self._reply(200, {'result': result})
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                               socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address, service):
+    """Make a threading HTTP server of service listening on address."""
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        server = _ThreadingUnixHTTPServer(addr, ProbeRequestHandler)
+    else:
+        server = _ThreadingHTTPServer(addr, ProbeRequestHandler)
+    server.service = service
+    return server
+
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        http_client.HTTPConnection.__init__(self, 'localhost',
+                                            timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class ProbeClient(object):
+
+    """Thin client of the probe daemon."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        self._address = address
+        self._timeout = timeout
+
+    def _connection(self):
+        family, addr = parse_address(self._address)
+        if family == socket.AF_UNIX:
+            return _UnixHTTPConnection(addr, self._timeout)
+        return http_client.HTTPConnection(addr[0], addr[1],
+                                          timeout=self._timeout)
+
+    def _request(self, method, path, body=None):
+        conn = self._connection()
+        try:
+            headers = {}
+            if body is not None:
+                body = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def probe(self, url, **options):
+        """Probe url with daemon, same result as probe_and_select_from_stream.
+
+        :param options: arguments of AudioProber, see JOB_OPTIONS"""
+        status, data = self._request(
+            'POST', '/probe', {'url': url, 'options': options})
+        data = json.loads(data.decode('utf-8'))
+        if status != 200:
+            raise ProbeError(data.get('error'))
+        return decode_result(data['result'])
+
+    def metrics(self):
+        return self._request('GET', '/metrics')[1].decode('utf-8')
+
+    def stats(self):
+        return json.loads(self._request('GET', '/stats')[1].decode('utf-8'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='auprobe serve',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-l', '--listen', default=DEFAULT_ADDRESS,
+                        help='unix:/path/of/socket or host:port')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='max number of jobs run at the same time')
+    parser.add_argument('--per_host', type=int, default=2,
+                        help='max connections to one host at the same time')
+    parser.add_argument('--per_host_rate', type=float, default=None,
+                        help='max jobs of one host started per second')
+    parser.add_argument('--cache', default=None,
+                        help='path of SQLite cache of probing results')
+    parser.add_argument('--history', default=None,
+                        help='path of per-host history of connection times')
+    parser.add_argument('--pool_http', action='store_true',
+                        help='fetch http urls once over pooled connections')
+    parser.add_argument('--spool_dir', default=None,
+                        help='keep captures of jobs with spool and reuse them')
+    args = parser.parse_args(argv)
+
+    config_log.config_log('/tmp', 'auprobed.log', 'INFO')
+    logger = logging.getLogger(__name__)
+    logger.info('Arguments: %s', args)
+
+    cache = None
+    if args.cache:
+        cache = probecache.ProbeCache(args.cache)
+    history = None
+    if args.history:
+        history = hoststats.HostHistory(args.history)
+    http_pool = None
+    if args.pool_http:
+        http_pool = httpfeed.SessionPool()
+    service = ProbeService(args.workers, cache,
+                           args.per_host, args.per_host_rate, history,
+                           http_pool, args.spool_dir)
+    server = make_server(args.listen, service)
+    logger.info('Serving on %s', args.listen)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
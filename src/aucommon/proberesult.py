@@ -0,0 +1,250 @@
+"""
+Compact Probing Results and Streaming Exporters
+
+ProbeResult keeps a result of probe_and_select_from_stream in slots,
+abnormals as a bit mask and volume / loudness as a typed table of
+channels, and flattens it into rows of scalars and lists, which are
+written as JSON Lines with ujson or as Parquet with pyarrow.
+"""
+
+import collections
+from array import array
+
+import ujson
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, see extras_require of setup.py
+    pyarrow = None
+
+CHANNEL_ORI = -1  # same as auprobe
+CHANNEL_MERGED = -2
+NAN = float('nan')
+# scalar fields of results, in order of columns
+FIELDS = ('url', 'codec', 'profile', 'bit_rate', 'sample_rate', 'channels',
+          'duration', 'format_name', 'index', 'best_url',
+          'selected_protocol', 'con_time', 'tested_duration',
+          'analysis_confidence', 'probe_tier')
+# abnormals kept as bits of flags, in order of bits
+FLAGS = ('inverted', 'll', 'rr', 'too_loud', 'too_low')
+CONFIDENCES = ('inverted_confidence', 'll_confidence', 'rr_confidence')
+BATCH_SIZE = 10000  # rows per Parquet row group
+
+ChannelStats = collections.namedtuple(
+    'ChannelStats', 'channel volume_mean volume_max loudness')
+
+
+def _nan_to_none(value):
+    return None if value != value else value
+
+
+def _none_to_nan(value):
+    return NAN if value is None else value
+
+
+class ProbeResult(object):
+
+    """Result of probing a url in slots and arrays.
+
+    Channels of the table are CHANNEL_ORI (whole track), CHANNEL_MERGED
+    (mid-mix of stereo) and channel indexes, unknown values are nan."""
+
+    __slots__ = FIELDS + ('input_options', 'output_options', 'flags',
+                          'confidences', 'channel_ids', 'volume_mean',
+                          'volume_max', 'loudness')
+
+    def __init__(self, **fields):
+        for k in FIELDS:
+            setattr(self, k, fields.get(k))
+        self.input_options = fields.get('input_options') or []
+        self.output_options = fields.get('output_options') or []
+        self.flags = fields.get('flags', 0)
+        self.confidences = array('d', fields.get(
+            'confidences', [NAN] * len(CONFIDENCES)))
+        self.channel_ids = array('b', fields.get('channel_ids', []))
+        self.volume_mean = array('d', fields.get('volume_mean', []))
+        self.volume_max = array('d', fields.get('volume_max', []))
+        self.loudness = array('d', fields.get('loudness', []))
+
+    @classmethod
+    def from_dict(cls, result, url=None):
+        """Make a ProbeResult of a result of probe_and_select_from_stream.
+
+        track_analysis of all tracks is not kept."""
+        fields = dict((k, result.get(k)) for k in FIELDS)
+        fields['url'] = url if url is not None else result.get('url')
+        fields['input_options'] = result.get('input_options')
+        fields['output_options'] = result.get('output_options')
+        abnormals = result.get('abnormals') or {}
+        fields['flags'] = sum(1 << i for i, k in enumerate(FLAGS)
+                              if abnormals.get(k))
+        fields['confidences'] = [
+            NAN if abnormals.get(k) is None else abnormals[k]
+            for k in CONFIDENCES]
+
+        volume = result.get('volume') or {}
+        loudness = result.get('loudness') or {}
+        channels = sorted(set(volume) | set(loudness), key=int)
+        fields['channel_ids'] = [int(c) for c in channels]
+        fields['volume_mean'] = [
+            _none_to_nan((volume.get(c) or {}).get('volume_mean'))
+            for c in channels]
+        fields['volume_max'] = [
+            _none_to_nan((volume.get(c) or {}).get('volume_max'))
+            for c in channels]
+        fields['loudness'] = [_none_to_nan(loudness.get(c))
+                              for c in channels]
+        return cls(**fields)
+
+    def has_flag(self, name):
+        return bool(self.flags & (1 << FLAGS.index(name)))
+
+    @property
+    def abnormals(self):
+        abnormals = dict((k, self.has_flag(k)) for k in FLAGS)
+        for k, v in zip(CONFIDENCES, self.confidences):
+            abnormals[k] = _nan_to_none(v)
+        return abnormals
+
+    def channel_table(self):
+        """Get volume and loudness of channels.
+
+        Will return a list of ChannelStats."""
+        return [ChannelStats(*row) for row in zip(
+            self.channel_ids, self.volume_mean, self.volume_max,
+            self.loudness)]
+
+    def channel(self, channel):
+        """Get ChannelStats of <channel>, None if not analyzed."""
+        for stats in self.channel_table():
+            if stats.channel == channel:
+                return stats
+        return None
+
+    def to_dict(self):
+        """Get result in the form of probe_and_select_from_stream."""
+        result = dict((k, getattr(self, k)) for k in FIELDS)
+        result['input_options'] = list(self.input_options)
+        result['output_options'] = list(self.output_options)
+        result['volume'] = dict(
+            (stats.channel, {'volume_max': _nan_to_none(stats.volume_max),
+                             'volume_mean': _nan_to_none(stats.volume_mean)})
+            for stats in self.channel_table())
+        result['loudness'] = dict(
+            (stats.channel, _nan_to_none(stats.loudness))
+            for stats in self.channel_table())
+        result['abnormals'] = self.abnormals
+        return result
+
+    def to_row(self):
+        """Flatten into a dict of scalars and lists, nan as None."""
+        row = dict((k, getattr(self, k)) for k in FIELDS)
+        row['input_options'] = list(self.input_options)
+        row['output_options'] = list(self.output_options)
+        for k in FLAGS:
+            row[k] = self.has_flag(k)
+        for k, v in zip(CONFIDENCES, self.confidences):
+            row[k] = _nan_to_none(v)
+        row['channel_ids'] = list(self.channel_ids)
+        for k in ('volume_mean', 'volume_max', 'loudness'):
+            row[k] = [_nan_to_none(v) for v in getattr(self, k)]
+        return row
+
+
+def _as_result(result):
+    if isinstance(result, ProbeResult):
+        return result
+    return ProbeResult.from_dict(result)
+
+
+class JSONLinesWriter(object):
+
+    """Write results as rows of JSON Lines with ujson."""
+
+    def __init__(self, fileobj):
+        """Writer.
+
+        :param fileobj: a text file object, like sys.stdout"""
+        self._fileobj = fileobj
+
+    def write(self, result):
+        """Write a ProbeResult or a result dict."""
+        self.write_row(_as_result(result).to_row())
+
+    def write_row(self, row):
+        """Write a dict as it is, like a row of ProbeResult.to_row."""
+        self._fileobj.write(ujson.dumps(row, escape_forward_slashes=False))
+        self._fileobj.write('\n')
+        self._fileobj.flush()
+
+    def close(self):
+        self._fileobj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetWriter(object):
+
+    """Write results as rows of a Parquet file, batch by batch."""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        """Writer.
+
+        :param path: path of Parquet file
+        :param batch_size: rows buffered before writing a row group"""
+        if pyarrow is None:
+            raise ImportError('pyarrow is required by ParquetWriter')
+        self._path = path
+        self._batch_size = batch_size
+        self._rows = []
+        self._writer = pyarrow.parquet.ParquetWriter(path, parquet_schema())
+
+    def write(self, result):
+        """Write a ProbeResult or a result dict."""
+        self._rows.append(_as_result(result).to_row())
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._writer.write_table(pyarrow.Table.from_pylist(
+                self._rows, schema=self._writer.schema))
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parquet_schema():
+    """Schema of rows of ProbeResult.to_row."""
+    types = {
+        'bit_rate': pyarrow.int64(),
+        'sample_rate': pyarrow.int32(),
+        'channels': pyarrow.int16(),
+        'index': pyarrow.int16(),
+        'duration': pyarrow.float64(),
+        'con_time': pyarrow.float64(),
+        'tested_duration': pyarrow.float64(),
+        'analysis_confidence': pyarrow.float64(),
+        }
+    fields = [(k, types.get(k, pyarrow.string())) for k in FIELDS]
+    fields += [(k, pyarrow.list_(pyarrow.string()))
+               for k in ('input_options', 'output_options')]
+    fields += [(k, pyarrow.bool_()) for k in FLAGS]
+    fields += [(k, pyarrow.float64()) for k in CONFIDENCES]
+    fields.append(('channel_ids', pyarrow.list_(pyarrow.int8())))
+    fields += [(k, pyarrow.list_(pyarrow.float64()))
+               for k in ('volume_mean', 'volume_max', 'loudness')]
+    return pyarrow.schema(fields)
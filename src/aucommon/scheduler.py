@@ -0,0 +1,154 @@
+"""
+Per-Host Scheduling of Probing Jobs
+
+Jobs are grouped by host, every host gets a connection limit and a
+request rate on top of the global worker limit, and hosts with pending
+jobs are served round robin so that one big origin can not starve the
+others while workers stay busy.
+A job counts as many connections as it opens at the same time, e.g.
+probers racing protocols or hedging.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future, as_completed
+
+from aucommon import auprobe
+
+
+class HostScheduler(object):
+
+    """Run jobs on a pool of workers with per-host budgets."""
+
+    def __init__(self, max_workers=8, per_host=2, per_host_rate=None):
+        """Scheduler.
+
+        :param max_workers: max number of jobs run at the same time
+        :param per_host: max number of connections to one host at the
+            same time, a job opening more connections still runs when
+            no other job of its host is running
+        :param per_host_rate: max number of jobs of one host started
+            per second, None for no limit.
+        Local files (empty host) are limited by max_workers only."""
+        self._per_host = per_host
+        self._interval = 1.0 / per_host_rate if per_host_rate else 0
+        self._cond = threading.Condition()
+        self._pending = {}  # deques of (future, fn, args, kwargs) by host
+        self._hosts = collections.deque()  # hosts with pending jobs
+        self._running = collections.Counter()  # connections by host
+        self._next_start = {}  # earliest start time by host
+        self._shutdown = False
+        self._workers = [threading.Thread(target=self._work)
+                         for _ in range(max_workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, host, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) as a job of host opening one
+        connection.
+
+        Will return a concurrent.futures.Future."""
+        return self.submit_weighted(host, 1, fn, *args, **kwargs)
+
+    def submit_weighted(self, host, connections, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) as a job of host opening
+        <connections> connections at the same time.
+
+        Will return a concurrent.futures.Future."""
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('Scheduler is shut down')
+            if host not in self._pending:
+                self._pending[host] = collections.deque()
+                self._hosts.append(host)
+            self._pending[host].append(
+                (future, connections, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def submit_probe(self, url, **kwargs):
+        """Schedule probe_and_select_from_stream(url, **kwargs)."""
+        return self.submit_weighted(
+            auprobe.AudioProber.host_of(url),
+            auprobe.AudioProber.connections_of(url, **kwargs),
+            auprobe.probe_and_select_from_stream, url, **kwargs)
+
+    def probe_many(self, urls, **kwargs):
+        """Probe urls, yield results as they finish.
+
+        Will yield tuples:
+            (url, result, error)
+        with exactly one of result and error being None."""
+        futures = dict((self.submit_probe(url, **kwargs), url)
+                       for url in urls)
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is None:
+                yield futures[future], future.result(), None
+            else:
+                yield futures[future], None, error
+
+    def _next_job(self):
+        """Pick next job round robin among hosts within budget.
+
+        Will return a tuple:
+            (host, job), or (None, seconds to wait) if no job can start"""
+        now = time.time()
+        wait = None
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            self._hosts.rotate(-1)
+            connections = self._pending[host][0][1]
+            if host and self._running[host] and \
+                    self._running[host] + connections > self._per_host:
+                continue
+            next_start = self._next_start.get(host, 0)
+            if host and next_start > now:
+                wait = next_start - now if wait is None \
+                    else min(wait, next_start - now)
+                continue
+            job = self._pending[host].popleft()
+            if not self._pending[host]:
+                del self._pending[host]
+                self._hosts.remove(host)
+            self._running[host] += connections
+            if self._interval:
+                self._next_start[host] = now + self._interval
+            return host, job
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._shutdown and not self._pending:
+                        return
+                    host, job = self._next_job()
+                    if host is not None:
+                        break
+                    self._cond.wait(job)
+            future, connections, fn, args, kwargs = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running[host] -= connections
+                    self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs, pending jobs are still run."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -10,7 +10,7 @@ setup(
     zip_safe=False,
 
     description="AuCommon",
-    long_description="Audio Tools for Python 2 / 3",
+    long_description="Audio Tools for Python 3",
     author="coppla",
     author_email="januszry@gmail.com",
 
@@ -18,10 +18,16 @@ setup(
     keywords=("utils"),
     platforms="Independant",
     url="",
+    python_requires=">=3.7",
     entry_points={'console_scripts': [
         'auprobe=aucommon.auprobe:main',
+        'auprobe-bench=aucommon.bench:main',
         ]},
 
     install_requires=["requests>=2.3.0",
                       "ujson>=1.33",
-                      "hexdump>=3.2"])
+                      "hexdump>=3.2"],
+    extras_require={
+        'numpy': ["numpy>=1.9"],
+        'parquet': ["pyarrow>=7.0"],
+        })
@@ -0,0 +1,47 @@
+import asyncio
+import math
+import struct
+import wave
+
+import pytest
+
+from aucommon import asyncprobe, auprobe, probecache
+
+
+@pytest.fixture
+def wav_path(tmp_path):
+    path = str(tmp_path / 'tone.wav')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b''.join(
+            struct.pack('<hh', v, v) for v in (
+                int(8000 * math.sin(2 * math.pi * 440 * i / 8000))
+                for i in range(8000 * 12))))
+    return path
+
+
+def cache_events(events):
+    return [(e['kind'], e['outcome']) for e in events
+            if e['stage'] == 'cache']
+
+
+def test_cache_is_shared_with_sync_prober(tmp_path, wav_path):
+    cache = probecache.ProbeCache(str(tmp_path / 'cache.db'))
+    events = []
+    expected = auprobe.probe_and_select_from_stream(
+        wav_path, cache=cache, instrument=events.append)
+    assert cache_events(events) == [('tracks', 'miss'), ('analysis', 'miss')]
+
+    del events[:]
+    result = asyncio.run(asyncprobe.async_probe_and_select_from_stream(
+        wav_path, cache=cache, instrument=events.append))
+    assert cache_events(events) == [('tracks', 'hit'), ('analysis', 'hit')]
+    assert result == expected
+
+
+@pytest.mark.parametrize('option', asyncprobe.UNSUPPORTED_OPTIONS)
+def test_unsupported_options(wav_path, option):
+    with pytest.raises(ValueError):
+        asyncprobe.AsyncAudioProber(wav_path, **{option: 2})
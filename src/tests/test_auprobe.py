@@ -0,0 +1,45 @@
+from aucommon import auprobe
+from aucommon.auprobe import CHANNEL_MERGED, CHANNEL_ORI
+
+
+def analysis(mean, loudness):
+    volume = dict((channel, {'volume_mean': mean, 'volume_max': mean + 10})
+                  for channel in (CHANNEL_ORI, 0, 1, CHANNEL_MERGED))
+    return volume, {CHANNEL_ORI: loudness}
+
+
+def test_track_health_of_silent_tracks():
+    for mean, loudness in ((float('-inf'), -70.0), (-91.0, -70.0),
+                           (-40.0, -70.0)):
+        health = auprobe.track_health(*analysis(mean, loudness), channels=2)
+        assert health['silent']
+        assert not health['broken']
+        assert not health['healthy']
+        assert not health['inverted']
+
+
+def test_track_health_of_missing_summaries():
+    health = auprobe.track_health({}, {}, channels=2)
+    assert health['broken']
+    assert not health['healthy']
+
+
+def test_silent_track_is_deselected(tmp_path):
+    path = tmp_path / 'two_tracks.mka'
+    path.write_bytes(b'')
+    ap = auprobe.AudioProber(str(path))
+    ap._proto = 'file'
+    ap._tracks = dict((index, {
+        'index': index, 'codec': 'aac', 'bit_rate': bit_rate,
+        'duration': 30.0, 'channels': 2,
+        }) for index, bit_rate in ((0, 256000), (1, 64000)))
+    assert ap._get_best_track()['index'] == 0
+
+    ap.track_analysis = {}
+    for index, (mean, loudness) in ((0, (-91.0, -70.0)), (1, (-20.0, -14.0))):
+        volume, loudness = analysis(mean, loudness)
+        ap.track_analysis[index] = {
+            'volume': volume, 'loudness': loudness,
+            'health': auprobe.track_health(volume, loudness, 2),
+            }
+    assert ap._get_best_track()['index'] == 1
@@ -0,0 +1,59 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from aucommon import httpfeed
+
+BITRATE = 128000  # bits per second sent by the live server
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+
+    """Never-ending stream at BITRATE, ignoring Range like Icecast."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.end_headers()
+        chunk = b'\xff' * (BITRATE // 8 // 10)
+        try:
+            while True:
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                time.sleep(0.1)
+        except (IOError, OSError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def live_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LiveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/live'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_prefetch_of_slow_live_stream_is_bounded_by_time(live_url):
+    feed = httpfeed.HTTPFeed(live_url, requests.Session(), timeout=10,
+                             prefetch_time=0.5)
+    start_time = time.time()
+    try:
+        prefix = feed.prefetch()
+        elapsed = time.time() - start_time
+        assert elapsed < 1.5
+        assert 0 < len(prefix) < httpfeed.PREFETCH_SIZE
+        assert feed.is_live
+        assert feed.con_time < elapsed
+    finally:
+        feed.close()
+
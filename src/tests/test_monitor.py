@@ -0,0 +1,34 @@
+import json
+
+from aucommon.auprobe import CHANNEL_ORI
+from aucommon.monitor import ASTATS_KEYS, _Window
+from aucommon.pcmanalysis import VOLUME_MIN
+
+MODULES = {0: ('ametadata', CHANNEL_ORI), 1: ('ametadata', CHANNEL_ORI),
+           2: ('ebur128', CHANNEL_ORI)}
+
+
+def strict_loads(data):
+    def reject(constant):
+        raise ValueError('invalid json constant {}'.format(constant))
+    return json.loads(data, parse_constant=reject)
+
+
+def test_silent_window_is_valid_json():
+    window = _Window(1.0)
+    done = False
+    for i in range(11):
+        window.feed('[Parsed_ametadata_0 @ 0x1] {}=-inf'.format(
+            ASTATS_KEYS[0]), MODULES)
+        window.feed('[Parsed_ametadata_1 @ 0x1] {}=-inf'.format(
+            ASTATS_KEYS[1]), MODULES)
+        done = window.feed(
+            '[Parsed_ebur128_2 @ 0x1] t: {:.1f}  TARGET:-23 LUFS    '
+            'M:-120.7 S:-120.7     I: -70.0 LUFS       LRA:   0.0 LU'.format(
+                i / 10.0), MODULES)
+    assert done
+
+    event = strict_loads(json.dumps(window.result(channels=1)))
+    volume = event['volume'][str(CHANNEL_ORI)]
+    assert volume == {'volume_mean': VOLUME_MIN, 'volume_max': VOLUME_MIN}
+    assert event['flags']['silent']